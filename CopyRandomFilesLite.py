@@ -1,24 +1,24 @@
 # A simple version of my Copy Random Files program. 
 # Set the number of files you want to copy, the folder you want to copy from (root), and the folder you want to copy to (destination).
 # See the advanced version here: https://github.com/jang-w/Copy-Random-Files-Advanced
+# Start with --timing to print the time to the first window and from each click on Start to the run starting.
 
-import os
+from time import perf_counter
+STARTED = perf_counter()  # for --timing, before the Qt imports
 import sys
-import shutil
-import random
-import inspect
-import datetime
 import collections
 from pathlib import Path
-from time import perf_counter, time
-from PySide2.QtWidgets import *
-from PySide2.QtGui import *
-from PySide2.QtCore import *
+from PySide2.QtCore import QObject, QRunnable, QThreadPool, QTimer, QSettings, QDir, QRegExp, QSize, QPoint, Qt, Signal
+from PySide2.QtGui import QRegExpValidator
+from PySide2.QtWidgets import (QApplication, QWidget, QGroupBox, QHBoxLayout, QVBoxLayout, QLabel, QPushButton, QSpinBox,
+        QCheckBox, QLineEdit, QComboBox, QProgressBar, QTextBrowser, QTextEdit, QFileDialog)
+# MandalaEngine and MandalaJob (with sqlite3, hashlib, concurrent.futures, ...) are imported once the window is shown
+
+PROGRESS_INTERVAL = 100  # ms between log and progress bar updates during a run
+LOG_SCROLLBACK = 5000  # lines kept in the log display
+TIMING = '--timing' in sys.argv
 
 class WorkerSignals(QObject):
-    countSignal = Signal()
-    logSignal = Signal(object)
-    timeSignal = Signal()
     finishedSignal = Signal()
 
 class RunMandalaWorker(QRunnable):
@@ -29,8 +29,11 @@ class MainWindow(QWidget):
     def __init__(self):
         super().__init__()
         self.noWrap = '<p style="white-space:pre">'
-        self.wasEnabled = {}
-        self.listOfPaths = collections.defaultdict(bool)
+        self.wasEnabled = []
+        self.listOfPaths = {}
+        self.engine = None
+        # Log lines from the worker and copy threads, shown in batches by progressTimer
+        self.pendingLog = collections.deque()
 
         self.threadpool = QThreadPool()
         self.mandala = RunMandalaWorker()
@@ -44,8 +47,11 @@ class MainWindow(QWidget):
         
     def setupSignals(self):
         self.signals = WorkerSignals()
-        self.signals.countSignal.connect(lambda: self.progressBar.setValue(self.count))
-        self.signals.logSignal.connect(lambda s: self.logBlock.append(s))
+        self.signals.finishedSignal.connect(self.stopMandala)
+
+        self.progressTimer = QTimer(self)
+        self.progressTimer.setInterval(PROGRESS_INTERVAL)
+        self.progressTimer.timeout.connect(self.flushProgress)
 
     def makeSpin(self, lo, hi, enabled):
         name = QSpinBox()
@@ -66,12 +72,54 @@ class MainWindow(QWidget):
 
         self.numFilesCount = self.makeSpin(1, 1000000000, True)
 
+        self.copyWorkersLabel = QLabel('Workers')
+        self.copyWorkersCount = self.makeSpin(1, 64, True)
+        self.copyWorkersCount.setToolTip('Number of files copied in parallel')
+
+        self.singlePassCheck = QCheckBox('Single pass')
+        self.singlePassCheck.setToolTip('Scan the whole root once and sample from it, instead of a random walk for each file')
+
+        self.indexCheck = QCheckBox('Use index')
+        self.indexCheck.setToolTip('Keep an index of the root on disk and only rescan folders that changed since the last run')
+
+        self.budgetLabel = QLabel('Max GB')
+        self.budgetCount = self.makeSpin(0, 1000000, True)
+        self.budgetCount.setToolTip('Stop once this many GB have been copied (0 for no limit)')
+
+        self.filterEdit = QLineEdit()
+        self.filterEdit.setPlaceholderText('Only files like: jpg png IMG_*')
+
+        self.weightCheck = QCheckBox('Weight by size')
+        self.weightCheck.setToolTip('Pick large files more often, in proportion to their size')
+
+        self.seedEdit = QLineEdit()
+        self.seedEdit.setPlaceholderText('Seed')
+        self.seedEdit.setMaximumWidth(90)
+        self.seedEdit.setValidator(QRegExpValidator(QRegExp('[0-9]{0,18}')))
+        self.seedEdit.setToolTip('The same seed picks the same files again (empty for a new random seed, shown in the log)')
+
         countL = QHBoxLayout()
         countL.addWidget(self.fileCountLabel)
         countL.addWidget(self.numFilesCount)
+        countL.addWidget(self.copyWorkersLabel)
+        countL.addWidget(self.copyWorkersCount)
+        countL.addStretch()
+        countL.addWidget(self.singlePassCheck)
+        countL.addWidget(self.indexCheck)
+
+        selectionL = QHBoxLayout()
+        selectionL.addWidget(self.budgetLabel)
+        selectionL.addWidget(self.budgetCount)
+        selectionL.addWidget(self.filterEdit)
+        selectionL.addWidget(self.weightCheck)
+        selectionL.addWidget(self.seedEdit)
+
+        fileCountL = QVBoxLayout()
+        fileCountL.addLayout(countL)
+        fileCountL.addLayout(selectionL)
         
         self.fileCountG = QGroupBox('File count')
-        self.fileCountG.setLayout(countL)
+        self.fileCountG.setLayout(fileCountL)
 
     def setupRootUi(self): # self.rootG
         self.rootLabel = self.createGroupLabel('Root')
@@ -84,15 +132,26 @@ class MainWindow(QWidget):
 
         self.browseRootButton = QPushButton(' Browse')
 
+        self.allRootsCheck = QCheckBox('All roots')
+        self.allRootsCheck.setToolTip('Pick from every root in the list at once, as one pool of files')
+        self.rootQuotaCheck = QCheckBox('Equal share each')
+        self.rootQuotaCheck.setToolTip('Take the same number of files from every root instead of one pool')
+
         self.rootCombo.currentTextChanged.connect(self.changeRoot)
         self.browseRootButton.clicked.connect(self.browseRoot)
 
+        rootLabelL = QHBoxLayout()
+        rootLabelL.addWidget(self.rootLabel)
+        rootLabelL.addStretch()
+        rootLabelL.addWidget(self.allRootsCheck)
+        rootLabelL.addWidget(self.rootQuotaCheck)
+
         rootControls = QHBoxLayout()
         rootControls.addWidget(self.rootCombo)
         rootControls.addWidget(self.browseRootButton)
 
         rootL = QVBoxLayout()
-        rootL.addWidget(self.rootLabel)
+        rootL.addLayout(rootLabelL)
         rootL.addLayout(rootControls)
 
         self.rootG = QGroupBox()
@@ -109,12 +168,27 @@ class MainWindow(QWidget):
 
         self.browseDestButton = QPushButton(' Browse')
 
+        self.dedupCheck = QCheckBox('Skip same content')
+        self.dedupCheck.setToolTip('Compare file contents (hashed) instead of name and size to find duplicates')
+
+        self.resumeCheck = QCheckBox('Resume')
+        self.resumeCheck.setToolTip('Carry on from where a stopped or interrupted run into this folder left off')
+
+        self.allDestsCheck = QCheckBox('All destinations')
+        self.allDestsCheck.setToolTip('Copy every picked file to every destination in the list')
+        self.shardCheck = QCheckBox('Split')
+        self.shardCheck.setToolTip('Split the picked files between the destinations instead of copying them to each')
+
         self.destCombo.currentTextChanged.connect(self.changeDestination)
         self.browseDestButton.clicked.connect(self.browseDestination)
 
         destLabelL = QHBoxLayout()
         destLabelL.addWidget(self.destLabel)
         destLabelL.addStretch()
+        destLabelL.addWidget(self.dedupCheck)
+        destLabelL.addWidget(self.resumeCheck)
+        destLabelL.addWidget(self.allDestsCheck)
+        destLabelL.addWidget(self.shardCheck)
 
         destControls = QHBoxLayout()
         destControls.addWidget(self.destCombo)
@@ -154,6 +228,7 @@ class MainWindow(QWidget):
         self.logBlock.setMinimumHeight(175)
         self.logBlock.setMaximumHeight(175)
         self.logBlock.setLineWrapMode(QTextEdit.NoWrap)
+        self.logBlock.document().setMaximumBlockCount(LOG_SCROLLBACK)
 
         runRow = QHBoxLayout()
         runRow.addWidget(self.progressBar)
@@ -178,16 +253,24 @@ class MainWindow(QWidget):
         masterLayout.addWidget(self.destG)
         masterLayout.addLayout(self.runSection)
 
+        # Widgets kept between sessions, by settings key
+        self.savedCombos = {'rootCombo': self.rootCombo, 'destCombo': self.destCombo}
+        self.savedSpins = {'numFilesCount': self.numFilesCount, 'copyWorkersCount': self.copyWorkersCount,
+                'budgetCount': self.budgetCount}
+        self.savedChecks = {'singlePassCheck': self.singlePassCheck, 'indexCheck': self.indexCheck,
+                'weightCheck': self.weightCheck, 'allRootsCheck': self.allRootsCheck, 'rootQuotaCheck': self.rootQuotaCheck,
+                'dedupCheck': self.dedupCheck, 'resumeCheck': self.resumeCheck, 'allDestsCheck': self.allDestsCheck,
+                'shardCheck': self.shardCheck}
+        self.savedEdits = {'filterEdit': self.filterEdit, 'seedEdit': self.seedEdit}
+        # Widgets disabled during a run (their children with them)
+        self.runLocked = [self.fileCountG, self.rootG, self.destG, self.progressBar, self.runButton]
+
         self.setLayout(masterLayout)
         self.setWindowTitle('Default - Copy Random Files')
         self.show()
 
     ### ROOT AND DESTINATION METHODS ###
 
-    def resetPathToStart(self):
-        os.chdir(self.root)
-        return Path.cwd()
-
     def changeRoot(self):
         self.root = Path(self.rootCombo.currentText())
 
@@ -223,265 +306,116 @@ class MainWindow(QWidget):
         self.root = Path(self.rootCombo.currentText())
         self.dest = Path(self.destCombo.currentText())
 
-        self.startAbsolute = os.path.abspath(self.root)
-        self.rename2 = ' '
-        self.isAppendLog = False
-        self.count = 0
-        self.bytesInCurrentFolder = 0
-        self.stallLimit = 30
-        self.startFolderTime = perf_counter() 
-        self.startStallTime = perf_counter()
+        # All remembered roots and destinations that still exist, for a job over several of them
+        self.roots = [self.root]
+        if self.allRootsCheck.isChecked():
+            self.roots = [Path(self.rootCombo.itemText(item)) for item in range(self.rootCombo.count())
+                    if Path(self.rootCombo.itemText(item)).is_dir()]
+        self.dests = [self.dest]
+        if self.allDestsCheck.isChecked():
+            self.dests = [Path(self.destCombo.itemText(item)) for item in range(self.destCombo.count())
+                    if Path(self.destCombo.itemText(item)).is_dir()]
+        self.rootMode = 'quota' if self.rootQuotaCheck.isChecked() else 'merged'
+        self.destMode = 'shard' if self.shardCheck.isChecked() else 'fanout'
+
+        # Copy Workers
+        self.copyWorkers = self.copyWorkersCount.value()
+
+        # Duplicates
+        self.dedupContent = self.dedupCheck.isChecked()
+        self.resume = self.resumeCheck.isChecked()
+
+        # Budget, Filter and Weighting
+        self.byteBudget = self.budgetCount.value() * 1024**3
+        self.patterns = self.filterEdit.text().replace(',', ' ').split()
+        self.weighting = 'size' if self.weightCheck.isChecked() else 'uniform'
+        self.seed = int(self.seedEdit.text()) if self.seedEdit.text() else None
+
+        # Selection Mode (size weighting needs at least a single pass)
+        if self.indexCheck.isChecked():
+            self.selectionMode = 'index'
+        elif self.singlePassCheck.isChecked() or self.weighting == 'size':
+            self.selectionMode = 'reservoir'
+        else:
+            self.selectionMode = 'walk'
 
     def runMandala(self):
-        self.assignGlobalVariables()
-        
-        self.touchedFiles = collections.defaultdict(bool)  # type: ignore
-        self.touchedFolders = collections.defaultdict(bool)  # type: ignore
-
-        if self.stopTracker:
-            self.stopMandala()
-            return
-
-        self.dest = Path(self.destCombo.currentText())
-
-        self.count = 0
-        self.dest = self.createFolders(self.dest)
-        
-        self.startFolderTime = perf_counter() 
-        self.startStallTime = perf_counter()
-        mainPath = self.resetPathToStart() 
-
-        self.progressBar.setRange(0, self.numberOfFiles)
-
-        for currFile in range(self.numberOfFiles):
-            if self.stopTracker:
-                self.stopMandala()
-                return
-            if self.touchedFolders[self.startAbsolute] and self.isTimedOut(self.startStallTime):
-                break
-
-            while not self.touchedFolders[self.startAbsolute] and not self.isTimedOut(self.startStallTime):
-                if self.stopTracker:
-                    self.stopMandala()
-                    return
-                mainPathAbsolute = os.path.abspath(mainPath)
-                # Try to get main path
-                try:
-                    if not self.listOfPaths[mainPathAbsolute]:
-                        self.listOfPaths[mainPathAbsolute] = os.listdir(mainPath)
-                except PermissionError:
-                    self.touchedFolders[mainPathAbsolute] = True 
-                    mainPath = self.resetPathToStart()
-                    continue
-                    
-                # If folder is empty
-                if (len(self.listOfPaths[mainPathAbsolute]) == 0):
-                    self.touchedFolders[mainPathAbsolute] = True
-                    mainPath = self.resetPathToStart()
-                    
-                # If the folder is not empty
-                else: 
-                    # Chooses random path and stores absolute path
-                    randomPath = Path(random.choice(self.listOfPaths[mainPathAbsolute]))
-                    randomPathAbsolute = os.path.abspath(randomPath)
-
-                    # If touched, try again:
-                    if self.touchedFiles[randomPathAbsolute] or self.touchedFolders[randomPathAbsolute]:
-                        self.touchFolderIfAllFilesTouched(self.listOfPaths[mainPathAbsolute], mainPathAbsolute)
-                        mainPath = self.resetPathToStart()  
-
-                    # If random path is folder
-                    if randomPath.is_dir():
-                        try:
-                            os.chdir(randomPath)
-                            mainPath = Path.cwd()
-
-                        except PermissionError:
-                            self.touchedFolders[randomPathAbsolute] = True 
-                            mainPath = self.resetPathToStart()
-
-                    # If random path is file:
-                    elif randomPath.is_file():
-                        # Get size
-                        self.touchedFiles[randomPathAbsolute] = True
-                        randomPathSize = os.path.getsize(randomPath)
-                        randomPathRelative = os.path.relpath(randomPath, self.root)
-                        # If file copy is valid
-                        if self.copyFilesToTarget(currFile, randomPath, self.dest, randomPathSize):
-                            if not self.isAppendLog:
-                                self.log.write(f'{currFile+1}: {randomPathRelative}\n')
-                                self.signals.logSignal.emit(f'{currFile+1}: {randomPathRelative}')
-                            else:
-                                self.dummyLog.write(f'{currFile+1}: {randomPathRelative}\n')
-                                self.signals.logSignal.emit(f'{currFile+1}: {randomPathRelative}')
-                                
-                            self.bytesInCurrentFolder += randomPathSize
-                            self.count += 1
-                            self.signals.countSignal.emit()
-                            self.startStallTime = perf_counter()
-                            self.signals.timeSignal.emit()
-                            
-                            mainPath = self.resetPathToStart()                               
-                            break
-                        # If file is invalid
-                        else: 
-                            mainPath = self.resetPathToStart()      
-
-        ##################################################   END OF FOLDER  ##################################################           
-        # Create and write log at the end of folder
-        self.stopMandala()
-
-    def copyFilesToTarget(self, fileNum, source, dest, sourceSize):
-        sourceAbsolute = os.path.abspath(source)
-        sourceName = source.name
+        # Runs on the thread pool; the window only hears back through pendingLog, engine.count and finishedSignal
         try:
-            x = 2
-            while (dest / f'{sourceName}').exists():
-                if sourceSize == os.path.getsize(dest / f'{sourceName}'):
-                    return False
-                sourceName = source.stem + f' ({x})' + source.suffix
-                x += 1
-            shutil.copy(sourceAbsolute, dest / f'{sourceName}')
-            return True
-        except PermissionError:
-            return False
-
-    def createFolders(self, target):
-        if Path(target/f'!{target.name}_log.txt').exists():
-            self.isAppendLog = True
-        else:
-            self.isAppendLog = False
-        self.log = open(target/f'!{target.name}_log.txt', 'a', encoding='utf-8')
-        self.dummyFile = self.log.name + '.bak'
-        self.dummyLog = open(target/self.dummyFile, 'a', encoding='utf-8')
-        return target
-    
-    def touchFolderIfAllFilesTouched(self, listOfPath, absolutePath):
-        for fileFolder in listOfPath:
-            path = os.path.abspath(fileFolder)
-            if self.touchedFiles[path] or self.touchedFolders[path]:
-                pass
-            else:
-                return
-        self.touchedFolders[absolutePath] = True
-    
+            self.engine.runMandala()
+        finally:
+            self.signals.finishedSignal.emit()
+
+    def flushProgress(self):
+        lines = []
+        while self.pendingLog:
+            lines.append(self.pendingLog.popleft())
+        if lines:
+            self.logBlock.append('\n'.join(lines))
+
+        if self.engine:
+            self.progressBar.setValue(min(self.engine.count, self.progressBar.maximum()))
+            elapsed = perf_counter() - self.engine.startFolderTime
+            if elapsed > 0:
+                filesPerSecond = self.engine.count / elapsed
+                megabytesPerSecond = self.engine.bytesInCurrentFolder / elapsed / 1024**2
+                self.progressBar.setFormat(f'%v  ({filesPerSecond:.1f} files/s, {megabytesPerSecond:.1f} MB/s)')
 
     ### PROGRESS, TIMER METHODS ###
 
-    def isTimedOut(self, startStallTime):
-        endStallTime = perf_counter()
-        if endStallTime - startStallTime > self.stallLimit: 
-            return True
-        else: 
-            return False
-
     def runMandalaPush(self):
-        for name, obj in inspect.getmembers(self):
-            if isinstance(obj, QWidget) and not (name in ['stopButton', 'logBlock']):
-                self.wasEnabled[name] = obj.isEnabled()
-
-        for name, obj in inspect.getmembers(self):
-            if isinstance(obj, QWidget) and not (name in ['stopButton', 'logBlock']):
-                obj.setEnabled(False)
+        pushTime = perf_counter()
+        self.wasEnabled = [widget.isEnabled() for widget in self.runLocked]
+        for widget in self.runLocked:
+            widget.setEnabled(False)
 
         self.progressBar.reset()
+        self.progressBar.setFormat('%v')
 
         self.runButton.setVisible(False)
         self.stopButton.setVisible(True)
         self.stopTracker = False
 
+        self.assignGlobalVariables()
+        if len(self.roots) > 1 or len(self.dests) > 1:
+            from MandalaJob import MandalaJob
+            # The byte budget and resuming apply to single runs only
+            self.engine = MandalaJob(self.numberOfFiles, self.roots, self.dests, rootMode=self.rootMode, destMode=self.destMode,
+                    seed=self.seed, logCallback=self.pendingLog.append, selectionMode=self.selectionMode,
+                    listOfPaths=self.listOfPaths, copyWorkers=self.copyWorkers, dedupContent=self.dedupContent,
+                    weighting=self.weighting, patterns=self.patterns)
+            self.progressBar.setRange(0, self.engine.totalFiles)
+        else:
+            from MandalaEngine import MandalaEngine
+            self.engine = MandalaEngine(self.numberOfFiles, self.root, self.dest, seed=self.seed, selectionMode=self.selectionMode,
+                    listOfPaths=self.listOfPaths, copyWorkers=self.copyWorkers, dedupContent=self.dedupContent,
+                    weighting=self.weighting, patterns=self.patterns, byteBudget=self.byteBudget,
+                    resume=self.resume, logCallback=self.pendingLog.append)
+            self.progressBar.setRange(0, self.numberOfFiles)
+
+        self.progressTimer.start()
         self.threadpool.globalInstance().start(self.mandala)
+        if TIMING:
+            print(f'Start: {round((perf_counter() - pushTime) * 1000, 1)}ms', file=sys.stderr)
+
+    def warmImports(self):
+        # Imported here so the first Start does not wait for them, the imports in runMandalaPush then cost nothing
+        import MandalaEngine, MandalaJob
 
     def stopMandalaPush(self):
         self.stopTracker = True
+        if self.engine:
+            self.engine.stopTracker = True
 
     def stopMandala(self):
-        self.signals.finishedSignal.emit()
-        
-        self.dummyLog.close()
-        self.log.close()
-        statusLog, statusLogApp = self.writeStatusLog()
-        self.prependStatusToLog(statusLog)
-        self.signals.logSignal.emit(statusLogApp)
+        self.progressTimer.stop()
+        self.flushProgress()
 
         self.runButton.setVisible(True)
         self.stopButton.setVisible(False)
         self.dest = Path(self.destCombo.currentText())
-        for name, obj in inspect.getmembers(self):
-            if isinstance(obj, QWidget) and not (name in ['stopButton', 'logBlock']):
-                obj.setEnabled(self.wasEnabled[name])
-            
-
-    ### LOG METHODS ###
-
-    def writeStatusLog(self):
-        endFolderTime = perf_counter()
-        endStallTime = perf_counter()
-        currentDate = datetime.datetime.now().strftime('%B %d, %Y')
-        currentTime = datetime.datetime.now().strftime('%I:%M:%S%p')
-        status = ''
-        timeOut = self.isTimedOut(self.startStallTime)
-
-        if self.count == self.numberOfFiles:
-            status = f'SUCCESS: {self.count}/{self.numberOfFiles} files copied'
-        elif timeOut and self.count == 0 and self.isCreateFolders: 
-            status = f'NO FILES FOUND: timed out | folder deleted'
-        elif self.touchedFolders[self.startAbsolute] and self.count == 0 and self.isCreateFolders: 
-            status = f'NO FILES FOUND: all files searched | folder deleted'
-        elif self.touchedFolders[self.startAbsolute]: 
-            status = f'ALL FILES SEARCHED: {self.count}/{self.numberOfFiles} files copied'
-        elif timeOut: 
-            status = f'TIMED OUT: {self.count}/{self.numberOfFiles} files copied'
-        elif self.stopTracker:
-            status = f'STOPPED: {self.count}/{self.numberOfFiles} files copied'       
-        statusLog = f'''------------------------------------------------------------------------
-    {status}
-    ------------------------------------------------------------------------
-    Date:\t\t{currentDate}
-    Time:\t\t{currentTime}
-    Start:\t\t{self.root} 
-    Destination:\t{self.dest}
-    Total size:\t{self.byteToMbGb(self.bytesInCurrentFolder)}
-    Total runtime:\t{round(endFolderTime - self.startFolderTime, 2)}s      
-    ------------------------------------------------------------------------'''
-        statusLogApp = f'''------------------------------------------------------------------------
-    {status}
-    ------------------------------------------------------------------------
-    Date:\t{currentDate}
-    Time:\t{currentTime}
-    Start:\t{self.root} 
-    Destination:\t{self.dest}
-    Total size:\t{self.byteToMbGb(self.bytesInCurrentFolder)}
-    Total runtime:\t{round(endFolderTime - self.startFolderTime, 2)}s      
-    ------------------------------------------------------------------------'''
-        return statusLog, statusLogApp
-
-    def prependStatusToLog(self, status):
-        # IF ITS A NEW LOG, APPEND STATUS
-        dummyLogAbsolute = os.path.abspath(self.dummyLog.name)
-        logAbsolute = os.path.abspath(self.log.name)
-        if not self.isAppendLog:
-            with open(logAbsolute, 'r', encoding='utf-8') as read_obj, open(dummyLogAbsolute, 'w', encoding='utf-8') as write_obj:
-                write_obj.write(status + '\n')
-                for status in read_obj:
-                    write_obj.write(status)
-            os.remove(logAbsolute)
-            os.rename(dummyLogAbsolute, logAbsolute)
-        else:
-            with open(dummyLogAbsolute, 'r', encoding='utf-8') as read_obj, open(logAbsolute, 'a', encoding='utf-8') as write_obj:
-                write_obj.write(status + '\n')
-                for status in read_obj:
-                    write_obj.write(status)
-            os.remove(dummyLogAbsolute)
-
-    def byteToMbGb(self, bytesInCurrentFolder):
-            BYTE_TO_MEGABYTE = 9.53674316406 * 10**(-7)
-            BYTE_TO_GIGABYTE = 9.31322575 * 10**(-10)
-            byteInGigabyte = 1073741824
-            if bytesInCurrentFolder < byteInGigabyte - 1:
-                return f'{round(bytesInCurrentFolder * BYTE_TO_MEGABYTE, 2)} MB'
-            else:
-                return f'{round(bytesInCurrentFolder * BYTE_TO_GIGABYTE, 2)} GB'
+        for widget, enabled in zip(self.runLocked, self.wasEnabled):
+            widget.setEnabled(enabled)
 
     ### SETTINGS METHODS ###
 
@@ -494,49 +428,66 @@ class MainWindow(QWidget):
         self.settings.setValue('size', self.size())
         self.settings.setValue('pos', self.pos())
 
-        for name, obj in inspect.getmembers(self):
-            if isinstance(obj, QComboBox):
-                items = []
-                for item in range(obj.count()):
-                    items.append(obj.itemText(item))
-                self.settings.setValue(name, items)  # save combobox selection to registry
+        for name, obj in self.savedCombos.items():
+            items = []
+            for item in range(obj.count()):
+                items.append(obj.itemText(item))
+            self.settings.setValue(name, items)  # save combobox selection to registry
 
-                index = obj.currentIndex()  # get current index from combobox
-                text = obj.itemText(index)  # get the text for current index
-                self.settings.setValue(f'current{name}', text)
-            
-            if isinstance(obj, QSpinBox):
-                value = obj.value()
-                self.settings.setValue(name, value)
+            index = obj.currentIndex()  # get current index from combobox
+            text = obj.itemText(index)  # get the text for current index
+            self.settings.setValue(f'current{name}', text)
+
+        for name, obj in self.savedSpins.items():
+            self.settings.setValue(name, obj.value())
+
+        for name, obj in self.savedChecks.items():
+            self.settings.setValue(name, obj.isChecked())
+
+        for name, obj in self.savedEdits.items():
+            self.settings.setValue(name, obj.text())
 
     def globalSettingsRestore(self):
         # Restore geometry  
         self.resize(self.settings.value('size', QSize(500, 500)))
         self.move(self.settings.value('pos', QPoint(60, 60)))
 
-        for name, obj in inspect.getmembers(self):
-            if isinstance(obj, QComboBox):
-                obj.clear()
-                allItems = (self.settings.value(name))
-                if allItems != None:
-                    obj.addItems(allItems)
-                
-                value = (self.settings.value(f'current{name}'))
-                if obj.findText(value) == -1:
-                    obj.addItem(value)
-                obj.setCurrentIndex(obj.findText(value))
-            
-            if isinstance(obj, QSpinBox):
-                value = self.settings.value(name)
-                if value != None:
-                    try:
-                        obj.setValue(value)
-                    except TypeError:
-                        obj.setValue(int(value))
+        for name, obj in self.savedCombos.items():
+            obj.clear()
+            allItems = (self.settings.value(name))
+            if allItems != None:
+                obj.addItems(allItems)
+
+            value = (self.settings.value(f'current{name}'))
+            if obj.findText(value) == -1:
+                obj.addItem(value)
+            obj.setCurrentIndex(obj.findText(value))
+
+        for name, obj in self.savedSpins.items():
+            value = self.settings.value(name)
+            if value != None:
+                try:
+                    obj.setValue(value)
+                except TypeError:
+                    obj.setValue(int(value))
+
+        for name, obj in self.savedChecks.items():
+            value = self.settings.value(name)
+            if value != None:
+                obj.setChecked(value in [True, 'true'])
+
+        for name, obj in self.savedEdits.items():
+            value = self.settings.value(name)
+            if value != None:
+                obj.setText(value)
 
 if __name__ == '__main__':
     app = QApplication(sys.argv)
     window = MainWindow()
+    if TIMING:
+        # Runs once the event loop has shown the window
+        QTimer.singleShot(0, lambda: print(f'First window: {round((perf_counter() - STARTED) * 1000, 1)}ms', file=sys.stderr))
+    QTimer.singleShot(0, window.warmImports)
     #with open('CRFStyleSheet.qss', 'r') as f:
     #    style = f.read()
     #    window.setStyleSheet(style)
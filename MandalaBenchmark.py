@@ -0,0 +1,332 @@
+# Benchmarks for the Copy Random Files Lite engine over synthetic folder trees.
+# Builds trees of a given shape, runs MandalaEngine headlessly on them for every selection mode and file count, and
+# reports the run time, the time spent walking and copying, the copy throughput, stat calls, folder listings and other
+# filesystem calls per copied file, peak memory and how often runs timed out. Every run happens in its own process, so the memory peak and the caches are its own.
+# Index runs get an index of their own, built before the run is timed, so every repeat samples from the same fresh index.
+#   python MandalaBenchmark.py --shapes wide deep sparse --counts 10 100 1000 --json today.json
+#   python MandalaBenchmark.py --shapes wide deep sparse --counts 10 100 1000 --compare today.json
+# With --compare, metrics that got more than --threshold percent worse than in the saved report are marked.
+
+import os
+import sys
+import json
+import math
+import random
+import shutil
+import argparse
+import tempfile
+import itertools
+import threading
+import subprocess
+from time import perf_counter
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+BLOCK = os.urandom(1024 * 1024)
+
+# folders: number of folders per file, depth: how folders nest, empty and unreadable: share of folders without files
+SHAPES = {
+    'flat': {'folders': 0, 'depth': 'wide', 'empty': 0, 'unreadable': 0},
+    'wide': {'folders': 0.05, 'depth': 'wide', 'empty': 0, 'unreadable': 0},
+    'deep': {'folders': 0.05, 'depth': 'deep', 'empty': 0, 'unreadable': 0},
+    # Unreadable folders are readable anyway when the benchmark runs as root
+    'sparse': {'folders': 0.5, 'depth': 'wide', 'empty': 0.8, 'unreadable': 0.1},
+}
+SIZES = ('small', 'skewed', 'fixed')
+
+# (report key, column title, format, True if a larger value is better)
+METRICS = [
+    ('runtime', 'run s', '{:.3f}', False),
+    ('walkSeconds', 'walk s', '{:.3f}', False),
+    ('copySeconds', 'copy s', '{:.3f}', False),
+    ('throughput', 'MB/s', '{:.1f}', True),
+    ('statsPerFile', 'stats/file', '{:.1f}', False),
+    ('listingsPerFile', 'listings/file', '{:.1f}', False),
+    ('fsCallsPerFile', 'fs calls/file', '{:.1f}', False),
+    ('readWriteCallsPerFile', 'read/write calls/file', '{:.1f}', False),
+    ('peakRss', 'peak MB', '{:.1f}', False),
+    ('timeoutRate', 'timeouts', '{:.0%}', False),
+    ('files', 'files', '{:.0f}', True),
+]
+
+# Audit events of the filesystem calls the engine makes. os.stat has none, stats are counted by wrapping os.stat and
+# os.lstat (which also covers os.path and pathlib); DirEntry.stat() of the single pass and index scans is not counted.
+FS_EVENTS = {'open', 'os.scandir', 'os.listdir', 'os.remove', 'os.rename', 'os.link', 'os.mkdir', 'os.truncate',
+        'shutil.copyfile', 'shutil.copymode'}
+LISTING_EVENTS = {'os.scandir', 'os.listdir'}
+
+
+### TREES ###
+
+def fileSize(sizes, rng):
+    if sizes == 'fixed':
+        return 1024
+    if sizes == 'skewed':
+        # Pareto: most files are a few KB, a few are tens of MB
+        return min(int(1024 * rng.paretovariate(1.2)), 64 * 1024 * 1024)
+    return rng.randint(1024, 4096)
+
+def writeFile(path, size):
+    with open(path, 'wb') as file:
+        while size > 0:
+            file.write(BLOCK[:min(size, len(BLOCK))])
+            size -= len(BLOCK)
+
+def makeTree(root, shape, fileCount, sizes='small', repeatedNames=False, seed=0):
+    # Returns the folders made unreadable, so removeTree() can make them readable again
+    rng = random.Random(seed)
+    settings = SHAPES[shape]
+    folders = [root]
+    for number in range(int(fileCount * settings['folders'])):
+        # Deep trees nest every folder under one of the last few, wide ones put them all under root
+        parent = folders[-rng.randint(1, min(3, len(folders)))] if settings['depth'] == 'deep' else root
+        folders.append(os.path.join(parent, f'folder{number}'))
+        os.mkdir(folders[-1])
+
+    rng.shuffle(folders)
+    emptyCount = int(len(folders) * settings['empty'])
+    unreadable = folders[:int(len(folders) * settings['unreadable'])]
+    fileFolders = folders[emptyCount:] or [root]
+
+    for number in range(fileCount):
+        # Repeated names with fixed sizes make most picks duplicates of earlier ones
+        name = f'file{rng.randrange(max(fileCount // 20, 1)) if repeatedNames else number}.bin'
+        path = os.path.join(rng.choice(fileFolders), name)
+        if not os.path.exists(path):
+            writeFile(path, fileSize(sizes, rng))
+
+    for folder in unreadable:
+        if folder != root:
+            os.chmod(folder, 0)
+    return unreadable
+
+def removeTree(root, unreadable):
+    for folder in unreadable:
+        if folder != root:
+            os.chmod(folder, 0o755)
+    shutil.rmtree(root, ignore_errors=True)
+
+
+### ONE RUN ###
+
+def readSyscalls():
+    # Read and write family syscalls of this process so far (syscr and syscw, no stat, getdents or open), Linux only
+    try:
+        with open('/proc/self/io') as io:
+            counts = dict(line.split(': ') for line in io.read().splitlines())
+        return int(counts['syscr']) + int(counts['syscw'])
+    except (OSError, KeyError, ValueError):
+        return None
+
+def peakRss():
+    # Peak resident memory of this process in MB (ru_maxrss is in KB on Linux and bytes on macOS)
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024**2 if sys.platform == 'darwin' else peak / 1024
+
+def runCase(case):
+    # Runs the engine once as described by case, in this process, and returns its metrics
+    from MandalaEngine import MandalaEngine
+    from MandalaIndex import MandalaIndex
+
+    if case['mode'] == 'index':
+        index = MandalaIndex(case['root'], case['indexPath'])
+        index.refresh(case['scanWorkers'])
+        index.close()
+
+    class TimedEngine(MandalaEngine):
+        def assignGlobalVariables(self):
+            super().assignGlobalVariables()
+            self.copySeconds = 0.0
+            self.timingLock = threading.Lock()
+
+        def copyFilesToTarget(self, fileNum, source, dest, sourceSize):
+            start = perf_counter()
+            try:
+                return super().copyFilesToTarget(fileNum, source, dest, sourceSize)
+            finally:
+                with self.timingLock:
+                    self.copySeconds += perf_counter() - start
+
+    # next() of itertools.count is atomic, the copy workers count too
+    fsCalls, listings, stats = itertools.count(), itertools.count(), itertools.count()
+    def countCall(event, args):
+        if event in FS_EVENTS:
+            next(fsCalls)
+        if event in LISTING_EVENTS:
+            next(listings)
+
+    def countStats(function):
+        def stat(*args, **kwargs):
+            next(stats)
+            return function(*args, **kwargs)
+        return stat
+
+    engine = TimedEngine(case['count'], case['root'], case['dest'], seed=case['seed'], selectionMode=case['mode'],
+            copyWorkers=case['workers'], indexPath=case['indexPath'], stallLimit=case['stallLimit'],
+            prefetchWorkers=case['prefetch'], listLatency=case['listLatency'], scanWorkers=case['scanWorkers'])
+    syscallsBefore = readSyscalls()
+    sys.addaudithook(countCall)
+    os.stat, os.lstat = countStats(os.stat), countStats(os.lstat)
+    startTime = perf_counter()
+    engine.runMandala()
+    runtime = perf_counter() - startTime
+    syscalls = readSyscalls()
+
+    files = max(engine.count, 1)
+    fsCalls, listings, stats = next(fsCalls), next(listings), next(stats)
+    return {
+        'runtime': runtime,
+        # Listing folders and stat calls of the walk, on the selection thread
+        'walkSeconds': engine.stats.seconds['listing'] + engine.stats.seconds['stat'],
+        'copySeconds': engine.copySeconds,
+        'throughput': engine.bytesInCurrentFolder / 1024**2 / engine.copySeconds if engine.copySeconds else 0.0,
+        'statsPerFile': stats / files,
+        'listingsPerFile': listings / files,
+        'fsCallsPerFile': fsCalls / files,
+        'readWriteCallsPerFile': (syscalls - syscallsBefore) / files if syscalls is not None else None,
+        'peakRss': peakRss(),
+        'timeoutRate': 1.0 if engine.writeStatusLog().startswith(('TIMED OUT', 'NO FILES FOUND: timed out')) else 0.0,
+        'files': engine.count,
+    }
+
+def runCaseProcess(case):
+    # Runs one case in a new interpreter and returns its metrics
+    output = subprocess.run([sys.executable, os.path.abspath(__file__), '--case', json.dumps(case)],
+            capture_output=True, text=True, check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+### BENCHMARK ###
+
+def average(values):
+    values = [value for value in values if value is not None]
+    return sum(values) / len(values) if values else None
+
+def benchmark(args):
+    results = []
+    workFolder = tempfile.mkdtemp(prefix='mandala-benchmark-', dir=args.work)
+    try:
+        for shape in args.shapes:
+            root = os.path.join(workFolder, shape)
+            os.mkdir(root)
+            startTime = perf_counter()
+            unreadable = makeTree(root, shape, args.files, args.sizes, args.repeated_names, args.seed)
+            print(f'{shape}: {args.files} files in {round(perf_counter() - startTime, 2)}s', file=sys.stderr)
+
+            for mode in args.modes:
+                for count in args.counts:
+                    runs = []
+                    for repeat in range(args.repeats):
+                        dest = tempfile.mkdtemp(dir=workFolder)
+                        indexPath = dest + '.sqlite3'
+                        runs.append(runCaseProcess({'root': root, 'dest': dest, 'count': count, 'mode': mode,
+                                'seed': args.seed + repeat, 'workers': args.workers, 'indexPath': indexPath,
+                                'stallLimit': args.stall_limit, 'prefetch': args.prefetch, 'listLatency': args.list_latency,
+                                'scanWorkers': args.scan_workers}))
+                        shutil.rmtree(dest, ignore_errors=True)
+                        if os.path.exists(indexPath):
+                            os.remove(indexPath)
+                    result = {'shape': shape, 'mode': mode, 'count': count}
+                    result.update({key: average([run[key] for run in runs]) for key, title, format, better in METRICS})
+                    results.append(result)
+                    print(formatRow(result, None, args.threshold), file=sys.stderr)
+            removeTree(root, unreadable)
+    finally:
+        shutil.rmtree(workFolder, ignore_errors=True)
+    return results
+
+
+### REPORT ###
+
+def caseKey(result):
+    return result['shape'], result['mode'], result['count']
+
+def formatValue(format, value):
+    return '-' if value is None else format.format(value)
+
+def formatRow(result, baseline, threshold):
+    cells = [f"{result['shape']:<8}{result['mode']:<11}{result['count']:>7}"]
+    for key, title, format, better in METRICS:
+        cell = formatValue(format, result[key])
+        if baseline and result[key] is not None and baseline.get(key) is not None:
+            change = relativeChange(baseline[key], result[key])
+            if change is not None:
+                worse = change < -threshold if better else change > threshold
+                cell += f" {change:+.0%}{'!' if worse else ''}"
+        cells.append(f'{cell:>{len(title) + 8}}')
+    return ''.join(cells)
+
+def relativeChange(old, new):
+    if old == 0:
+        return None if new == 0 else math.copysign(math.inf, new)
+    return (new - old) / abs(old)
+
+def printReport(results, baseline, threshold):
+    baselines = {caseKey(result): result for result in baseline or []}
+    header = f"{'shape':<8}{'mode':<11}{'count':>7}" + ''.join(f'{title:>{len(title) + 8}}' for key, title, format, better in METRICS)
+    print(header)
+    regressions = 0
+    for result in results:
+        old = baselines.get(caseKey(result))
+        row = formatRow(result, old, threshold)
+        regressions += row.count('!')
+        print(row)
+    if baseline is not None:
+        print(f'{regressions} metrics more than {threshold:.0%} worse than the baseline')
+    return regressions
+
+
+### COMMAND LINE ###
+
+def parseArgs(argv):
+    parser = argparse.ArgumentParser(description='Benchmark the engine over synthetic folder trees.')
+    parser.add_argument('--shapes', nargs='+', choices=sorted(SHAPES), default=['wide', 'deep', 'sparse'])
+    parser.add_argument('--files', type=int, default=2000, help='files per tree')
+    parser.add_argument('--sizes', choices=SIZES, default='small',
+            help='small: 1-4 KB, skewed: Pareto from 1 KB up to 64 MB, fixed: 1 KB')
+    parser.add_argument('--repeated-names', action='store_true', help='reuse file names, with --sizes fixed most picks are then duplicates')
+    parser.add_argument('--modes', nargs='+', choices=['walk', 'reservoir', 'index'], default=['walk', 'reservoir', 'index'])
+    parser.add_argument('--counts', nargs='+', type=int, default=[10, 100, 1000], help='numbers of files to copy')
+    parser.add_argument('--repeats', type=int, default=3, help='runs per case, with consecutive seeds')
+    parser.add_argument('--workers', type=int, default=1, help='copy workers')
+    parser.add_argument('--prefetch', type=int, default=0, metavar='THREADS', help='prefetch threads for the walk')
+    parser.add_argument('--scan-workers', type=int, default=0, metavar='PROCESSES',
+            help='processes scanning the tree for reservoir and index runs')
+    parser.add_argument('--list-latency', type=float, default=0, metavar='SECONDS',
+            help='latency added to every folder listing of the walk, like a network filesystem')
+    parser.add_argument('--stall-limit', type=float, default=5, help='seconds without any progress before a run times out')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--work', default=None, help='folder for the trees and destinations (default: the temp folder)')
+    parser.add_argument('--json', default=None, metavar='PATH', help='save the report')
+    parser.add_argument('--compare', default=None, metavar='PATH', help='compare with a saved report')
+    parser.add_argument('--threshold', type=float, default=10, help='percent change that counts as a regression')
+    parser.add_argument('--case', default=None, help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parseArgs(argv)
+    if args.case:
+        print(json.dumps(runCase(json.loads(args.case))))
+        return 0
+
+    args.threshold /= 100
+    baseline = None
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as file:
+            baseline = json.load(file)['results']
+
+    results = benchmark(args)
+    regressions = printReport(results, baseline, args.threshold)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as file:
+            json.dump({'settings': {key: value for key, value in vars(args).items() if key not in ('json', 'compare', 'case')},
+                    'results': results}, file, indent=1)
+    return 1 if regressions else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
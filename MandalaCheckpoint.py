@@ -0,0 +1,52 @@
+# Resumable runs for Copy Random Files Lite.
+# While a run copies into a destination folder it keeps '!<folder>_checkpoint.json' there with what a later run needs
+# to carry on where it stopped: the settings, the state of the random number generator, the count and bytes copied,
+# the files picked but not copied yet and the files being copied. The files picked before are not repeated in every
+# checkpoint: they are read back from the run journal (see picksFromJournal in MandalaJournal.py), which is flushed
+# before each checkpoint. The file is replaced atomically, so a crash leaves the last checkpoint intact, and a run
+# that reaches its target or runs out of files removes it.
+
+import os
+import json
+from pathlib import Path
+
+CHECKPOINT_FILES = 100  # save after this many more copied files
+CHECKPOINT_SECONDS = 5.0  # or after this long, whichever comes first
+
+# A checkpoint is only resumed by a run that samples the same files the same way
+MATCHING_SETTINGS = ('root', 'mode', 'weighting', 'patterns')
+
+
+def checkpointPath(dest):
+    dest = Path(dest)
+    return dest / f'!{dest.name}_checkpoint.json'
+
+def encodeRandomState(state):
+    version, internalState, gaussNext = state
+    return [version, list(internalState), gaussNext]
+
+def decodeRandomState(state):
+    version, internalState, gaussNext = state
+    return version, tuple(internalState), gaussNext
+
+def saveCheckpoint(path, checkpoint):
+    temporary = Path(path).with_name(Path(path).name + '.tmp')
+    with open(temporary, 'w', encoding='utf-8') as file:
+        json.dump(checkpoint, file, ensure_ascii=False)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temporary, path)
+
+def loadCheckpoint(path):
+    # None if there is no checkpoint or it cannot be read
+    try:
+        with open(path, 'r', encoding='utf-8') as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+def removeCheckpoint(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
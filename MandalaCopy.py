@@ -0,0 +1,243 @@
+# File copy helpers for Copy Random Files Lite.
+# DestinationIndex keeps the names and sizes of the files in the destination folder, so duplicate checks and free names need no stat calls.
+# On case-insensitive destinations (Windows, macOS) names that only differ in case are the same name.
+# fastCopy() tries the cheapest strategy the platform and filesystem allow and returns the one that was used:
+#   reflink          FICLONE ioctl, shares the blocks on btrfs, XFS and other copy-on-write filesystems
+#   copy_file_range  in-kernel copy (server-side on NFS 4.2 and some SMB mounts)
+#   sendfile         in-kernel copy on older Linux kernels
+#   chunked          userspace read/write loop, works everywhere
+# Only file data is copied, not permission bits or timestamps.
+# atomicCopy() writes to a hidden '.<name>.mandala-partial' file and renames it into place once complete, so a stop or
+# a crash never leaves a half-written file under the real name; removePartials() cleans up after a crash.
+
+import os
+import re
+import sys
+import errno
+import tempfile
+import collections
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+FICLONE = 0x40049409
+CHUNK_SIZE = 64 * 1024 * 1024  # bytes per kernel call, so a stop request is noticed between calls
+BUFFER_SIZE = 1024 * 1024
+PARTIAL_SUFFIX = '.mandala-partial'
+
+# Errors that mean "this strategy does not work here", as opposed to a real I/O error
+UNSUPPORTED = {errno.EXDEV, errno.EINVAL, errno.ENOSYS, errno.ENOTTY, errno.EBADF, errno.EPERM,
+        getattr(errno, 'EOPNOTSUPP', errno.EINVAL), getattr(errno, 'ENOTSUP', errno.EINVAL)}
+
+IS_LINUX = sys.platform.startswith('linux')
+
+
+class CopyCancelled(Exception):
+    pass
+
+
+class DestinationIndex:
+    # A file is a duplicate if a file with the same size already uses its name or one of its ' (n)' variants.
+    # Every name belongs to its own family as number 1, and 'name (n).ext' also to the family of 'name.ext' as number n.
+    SUFFIX = re.compile(r'^(.*) \((\d+)\)$')
+
+    def __init__(self, dest, foldCase=None):
+        # Families are keyed by lower-cased names if the destination ignores case (detected when foldCase is None)
+        self.foldCase = isCaseInsensitive(dest) if foldCase is None else foldCase
+        self.sizes = collections.defaultdict(set)
+        self.taken = collections.defaultdict(set)
+        self.nextFree = {}
+        self.existing = {}  # name -> size of the files found by the scan
+        with os.scandir(dest) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_file():
+                        self.existing[entry.name] = entry.stat().st_size
+                        self.add(entry.name, entry.stat().st_size)
+                except OSError:
+                    continue
+
+    def key(self, name):
+        return name.lower() if self.foldCase else name
+
+    def families(self, name):
+        name = self.key(name)
+        path = Path(name)
+        yield name, 1
+        match = self.SUFFIX.match(path.stem)
+        if match and int(match.group(2)) >= 2:
+            yield match.group(1) + path.suffix, int(match.group(2))
+
+    def add(self, name, size):
+        for family, number in self.families(name):
+            self.sizes[family].add(size)
+            self.taken[family].add(number)
+
+    def remove(self, name, size):
+        for family, number in self.families(name):
+            self.sizes[family].discard(size)
+            self.taken[family].discard(number)
+            if number >= 2 and number < self.nextFree.get(family, 2):
+                self.nextFree[family] = number
+
+    def reserve(self, name, size, checkDuplicates=True):
+        # Returns the name to copy to and records it, or None if the file is a duplicate
+        key = self.key(name)
+        if checkDuplicates and size in self.sizes[key]:
+            return None
+        taken = self.taken[key]
+        if 1 not in taken:
+            targetName = name
+        else:
+            number = self.nextFree.get(key, 2)
+            while number in taken:
+                number += 1
+            self.nextFree[key] = number + 1
+            path = Path(name)
+            targetName = path.stem + f' ({number})' + path.suffix
+        self.add(targetName, size)
+        return targetName
+
+
+def isCaseInsensitive(folder):
+    # Creates a hidden probe file in folder and looks for it under its upper-case name
+    try:
+        handle, probe = tempfile.mkstemp(prefix='.mandala-case-', dir=folder)
+    except OSError:
+        return os.path.normcase('A') == 'a'
+    os.close(handle)
+    try:
+        return os.path.exists(os.path.join(folder, os.path.basename(probe).upper()))
+    finally:
+        os.remove(probe)
+
+def partialPath(target):
+    target = Path(target)
+    return target.with_name(f'.{target.name}{PARTIAL_SUFFIX}')
+
+def atomicCopy(source, target, stopCheck=None, copy=None):
+    # Copies with copy(source, temporary, stopCheck) (fastCopy by default), then moves the complete file to target
+    # and returns what copy returned. Raises FileExistsError if target already exists.
+    copy = copy if copy else fastCopy
+    temporary = partialPath(target)
+    if os.path.lexists(target):
+        raise FileExistsError(errno.EEXIST, os.strerror(errno.EEXIST), str(target))
+    try:
+        os.remove(temporary)
+    except FileNotFoundError:
+        pass
+
+    try:
+        result = copy(source, temporary, stopCheck)
+    except BaseException:
+        if os.path.lexists(temporary):
+            os.remove(temporary)
+        raise
+
+    # A hard link never replaces a file created meanwhile; rename where links are not supported
+    try:
+        os.link(temporary, target)
+        os.remove(temporary)
+    except FileExistsError:
+        os.remove(temporary)
+        raise
+    except OSError:
+        os.replace(temporary, target)
+    return result
+
+def removePartials(dest):
+    # Removes the temporary files of copies that never finished; returns how many there were
+    removed = 0
+    with os.scandir(dest) as entries:
+        for entry in entries:
+            if entry.name.startswith('.') and entry.name.endswith(PARTIAL_SUFFIX):
+                try:
+                    os.remove(entry.path)
+                    removed += 1
+                except OSError:
+                    continue
+    return removed
+
+def fastCopy(source, target, stopCheck=None):
+    # Copies source to target (which must not exist yet) and returns the name of the strategy used.
+    # Raises CopyCancelled if stopCheck() becomes true, after removing the partial target.
+    stopCheck = stopCheck if stopCheck else lambda: False
+    with open(source, 'rb') as sourceFile, open(target, 'xb') as targetFile:
+        try:
+            sourceFd = sourceFile.fileno()
+            targetFd = targetFile.fileno()
+            if tryReflink(sourceFd, targetFd):
+                return 'reflink'
+            if tryCopyFileRange(sourceFd, targetFd, stopCheck):
+                return 'copy_file_range'
+            if trySendfile(sourceFd, targetFd, stopCheck):
+                return 'sendfile'
+            copyChunked(sourceFile, targetFile, stopCheck)
+            return 'chunked'
+        except BaseException:
+            targetFile.close()
+            os.remove(target)
+            raise
+
+def tryReflink(sourceFd, targetFd):
+    if fcntl is None or not IS_LINUX:
+        return False
+    try:
+        fcntl.ioctl(targetFd, FICLONE, sourceFd)
+        return True
+    except OSError as error:
+        if error.errno in UNSUPPORTED:
+            return False
+        raise
+
+def tryCopyFileRange(sourceFd, targetFd, stopCheck):
+    if not hasattr(os, 'copy_file_range'):
+        return False
+    copied = 0
+    while True:
+        if stopCheck():
+            raise CopyCancelled()
+        try:
+            sent = os.copy_file_range(sourceFd, targetFd, CHUNK_SIZE)
+        except OSError as error:
+            # Nothing written yet, so the next strategy can start from the beginning
+            if copied == 0 and error.errno in UNSUPPORTED:
+                return False
+            raise
+        if sent == 0:
+            return True
+        copied += sent
+
+def trySendfile(sourceFd, targetFd, stopCheck):
+    if not IS_LINUX or not hasattr(os, 'sendfile'):
+        return False
+    offset = 0
+    while True:
+        if stopCheck():
+            raise CopyCancelled()
+        try:
+            sent = os.sendfile(targetFd, sourceFd, offset, CHUNK_SIZE)
+        except OSError as error:
+            if offset == 0 and error.errno in UNSUPPORTED:
+                return False
+            raise
+        if sent == 0:
+            return True
+        offset += sent
+
+def copyChunked(sourceFile, targetFile, stopCheck):
+    sourceFile.seek(0)
+    targetFile.seek(0)
+    targetFile.truncate()
+    buffer = bytearray(BUFFER_SIZE)
+    view = memoryview(buffer)
+    while True:
+        if stopCheck():
+            raise CopyCancelled()
+        read = sourceFile.readinto(buffer)
+        if not read:
+            return
+        targetFile.write(view[:read])
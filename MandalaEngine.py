@@ -0,0 +1,882 @@
+# Headless sampling and copy engine for Copy Random Files Lite.
+# The window in CopyRandomFilesLite.py drives this class, but it has no Qt dependency so it can also be run from the command line:
+#   python MandalaEngine.py 100 /path/to/root /path/to/destination --seed 42
+
+import os
+import sys
+import shutil
+import math
+import heapq
+import hashlib
+import queue
+import json
+import random
+import cProfile
+import argparse
+import threading
+import itertools
+import collections
+from pathlib import Path
+from time import perf_counter
+from MandalaIndex import MandalaIndex, WeightedSampler, normalizePatterns, matchesPatterns
+from MandalaCopy import atomicCopy, removePartials, CopyCancelled, DestinationIndex
+from MandalaHash import HashCache, ContentDedup
+from MandalaJournal import (RunJournal, journalPath, formatStatus, byteToMbGb, manifestFromJournal, picksFromJournal,
+        writeManifest, readManifest)
+from MandalaStats import RunStats
+from MandalaLister import listFolder, delayedListing, PrefetchingLister
+from MandalaScan import scanTree
+from MandalaCheckpoint import (checkpointPath, saveCheckpoint, loadCheckpoint, removeCheckpoint, encodeRandomState,
+        decodeRandomState, CHECKPOINT_FILES, CHECKPOINT_SECONDS, MATCHING_SETTINGS)
+
+
+class MandalaEngine:
+    def __init__(self, numberOfFiles, root, dest, seed=None, selectionMode='walk', listOfPaths=None,
+            logCallback=None, countCallback=None, indexPath=None, refreshIndex=True, copyWorkers=1,
+            useFastCopy=True, dedupContent=False, hashCachePath=None, weighting='uniform', patterns=None, byteBudget=None,
+            resume=False, manifestPath=None, stallLimit=30, statsPath=None, profilePath=None, exclude=None,
+            prefetchWorkers=0, listLatency=0, scanWorkers=0, pickOnly=False):
+        # The run ends after numberOfFiles files or byteBudget bytes, whichever comes first; either one may be left out
+        self.numberOfFiles = numberOfFiles if numberOfFiles else sys.maxsize
+        self.byteBudget = byteBudget
+        # 'walk' picks each file with a random descent from root, 'reservoir' samples the whole tree in one pass,
+        # 'index' samples from the persistent index of root (see MandalaIndex.py), 'manifest' copies the files listed
+        # in the manifest at manifestPath. In the other modes a manifest of the run is written to manifestPath, if given.
+        if selectionMode == 'manifest' and not manifestPath:
+            raise ValueError('the manifest selection mode needs a manifest path')
+        self.selectionMode = selectionMode
+        self.manifestPath = manifestPath
+        self.indexPath = indexPath
+        self.refreshIndex = refreshIndex
+        # weighting is 'uniform' over files or 'size' (reservoir and index modes only), patterns are glob patterns
+        # or bare extensions that files must match
+        if weighting not in ('uniform', 'size'):
+            raise ValueError(f'unknown weighting: {weighting}')
+        if weighting == 'size' and selectionMode == 'walk':
+            raise ValueError('size weighting needs the reservoir or index selection mode')
+        self.weighting = weighting
+        self.patterns = normalizePatterns(patterns)
+        # More than one copy worker copies on a thread pool while selection keeps going
+        self.copyWorkers = copyWorkers
+        # useFastCopy uses MandalaCopy (reflink, then in-kernel copy, then chunked), otherwise shutil.copy
+        self.useFastCopy = useFastCopy
+        # dedupContent skips files whose content is already in the destination or picked this run (see MandalaHash.py),
+        # instead of the same name and size rule
+        self.dedupContent = dedupContent
+        self.hashCachePath = hashCachePath
+        # The run gives up after stallLimit seconds without any progress: no folder listed, no file picked or dropped
+        # and no copy in flight. Running out of files is detected exactly and ends the run at once (see runRandomWalk).
+        self.stallLimit = stallLimit
+        # statsPath gets the settings, results and statistics of the run as JSON (see MandalaStats.py),
+        # profilePath the cProfile statistics of the selection thread (copy workers are not profiled)
+        self.statsPath = statsPath
+        self.profilePath = profilePath
+        # prefetchWorkers lists the subfolders of the walk ahead of it on that many threads (see MandalaLister.py),
+        # listLatency adds that many seconds to every listing of the walk, to try prefetching out on a local disk
+        self.prefetchWorkers = prefetchWorkers
+        self.listFunction = delayedListing(listLatency) if listLatency else listFolder
+        # scanWorkers scans the tree on that many processes for 'reservoir' and the first build of an index (see MandalaScan.py)
+        self.scanWorkers = scanWorkers
+        # exclude is an iterable of absolute paths that are never picked (MandalaJob.py uses it to split a root between runs)
+        self.exclude = exclude
+        # pickOnly journals the picks in dest without copying them (MandalaJob.py copies them later from a manifest)
+        self.pickOnly = pickOnly
+        # resume carries on from the checkpoint a stopped, timed out or crashed run left in dest (see MandalaCheckpoint.py)
+        self.resume = resume
+        # Absolute paths, so log lines and the walk do not depend on the working directory
+        self.root = Path(os.path.abspath(root))
+        self.dest = Path(os.path.abspath(dest))
+        # Every run has a seed, so any run can be repeated; with the same seed the picks only depend on the tree
+        # (or the index) and the number of files
+        self.seed = seed if seed is not None else random.SystemRandom().randrange(2**32)
+        self.random = random.Random(self.seed)
+
+        # listOfPaths can be shared between runs (the window keeps one for its lifetime)
+        self.listOfPaths = listOfPaths if listOfPaths is not None else {}
+
+        # Callbacks are called from the worker or copy threads: logCallback(str), countCallback()
+        self.logCallback = logCallback if logCallback else lambda s: None
+        self.countCallback = countCallback if countCallback else lambda: None
+
+        self.stopTracker = False
+        self.assignGlobalVariables()
+
+    ### RUN METHODS ###
+
+    def assignGlobalVariables(self):
+        self.startAbsolute = os.path.abspath(self.root)
+        self.count = 0
+        self.bytesInCurrentFolder = 0
+        self.startFolderTime = perf_counter()
+        self.lastProgressTime = perf_counter()
+        self.stalled = False
+        self.walkRemaining = {}
+        # Eligible files in the folders the walk has listed that are not picked yet, and folders it has not listed yet:
+        # once both are 0 every file has been searched
+        self.filesLeft = 0
+        self.foldersUnlisted = 1
+        self.allFilesSearched = False
+        self.budgetFull = False
+        self.destIndex = None
+        self.contentDedup = None
+        self.copyStrategies = collections.Counter()
+        self.copyLock = threading.Lock()
+        self.copyPool = None
+        self.stats = RunStats()
+        self.lister = None
+        # Absolute paths of every file submitted, and the (path, size) picks not submitted yet, kept for the checkpoint
+        self.pickedFiles = set(self.exclude) if self.exclude else set()
+        self.pending = []
+        # (relativePath, size) of the files copied this run
+        self.copiedFiles = []
+        self.resumed = None
+        self.lastCheckpoint = (0, perf_counter())
+
+    def runMandala(self):
+        if not self.profilePath:
+            return self.runMandalaSteps()
+        profiler = cProfile.Profile()
+        try:
+            return profiler.runcall(self.runMandalaSteps)
+        finally:
+            profiler.dump_stats(self.profilePath)
+
+    def runMandalaSteps(self):
+        self.assignGlobalVariables()
+        self.checkpointPath = checkpointPath(self.dest)
+        if self.resume:
+            self.resumeFromCheckpoint()
+        if self.selectionMode == 'manifest' and not self.resumed:
+            self.loadManifest()
+        # Listings the walk reads have to drop files picked before this run started
+        self.filterPicked = bool(self.pickedFiles)
+        self.dest = self.createFolders(self.dest)
+
+        if self.stopTracker:
+            return self.stopMandala()
+
+        self.startFolderTime = perf_counter()
+        self.markProgress()
+        if self.dedupContent:
+            self.contentDedup = ContentDedup(HashCache(self.hashCachePath))
+            self.contentDedup.addFiles((os.path.join(self.dest, name), size) for name, size in self.destIndex.existing.items())
+        if self.copyWorkers > 1:
+            self.copyPool = CopyPool(self, self.copyWorkers)
+        if self.prefetchWorkers and self.selectionMode == 'walk':
+            self.lister = PrefetchingLister(self.listOfPaths, self.prefetchWorkers, listFunction=self.listFunction, stats=self.stats)
+        try:
+            if self.selectionMode == 'reservoir':
+                self.runReservoir()
+            elif self.selectionMode == 'index':
+                self.runIndexed()
+            elif self.selectionMode == 'manifest':
+                self.runManifest()
+            else:
+                self.runRandomWalk()
+        finally:
+            if self.lister:
+                self.lister.close()
+            if self.copyPool:
+                self.copyPool.close()
+            if self.contentDedup:
+                self.contentDedup.close()
+
+        # A finished run needs no checkpoint, any other keeps one to resume from
+        if self.isTargetReached() or self.allFilesSearched:
+            removeCheckpoint(self.checkpointPath)
+        else:
+            self.writeCheckpoint()
+
+        ##################################################   END OF FOLDER  ##################################################
+        # Create and write log at the end of folder
+        statusLog = self.stopMandala()
+        if self.manifestPath and self.selectionMode != 'manifest':
+            writeManifest(self.manifestPath, manifestFromJournal(journalPath(self.dest), self.journal.runId))
+        return statusLog
+
+    def runRandomWalk(self):
+        # Picks each file by walking down from root. Every folder keeps an array of its entries that are not used up yet:
+        # picked files and unreadable folders are swap-removed from it in O(1), and a folder whose array has run empty
+        # is removed from its parent the next time it is drawn. filesLeft and foldersUnlisted count what is left, so the
+        # run ends as soon as the last eligible file has been picked, without descending into used up folders again.
+        while self.needMoreFiles():
+            if self.stopTracker:
+                return
+            if self.filesLeft == 0 and self.foldersUnlisted == 0:
+                self.allFilesSearched = True
+            if self.allFilesSearched or self.isStalled():
+                break
+            self.checkpointIfDue()
+            self.walkToNextFile()
+
+    def walkToNextFile(self):
+        # Random descents from root until a file is accepted or every file has been searched
+        folder = self.startAbsolute
+        parentRemaining, parentIndex = None, None
+
+        while self.filesLeft or self.foldersUnlisted:
+            if self.stopTracker:
+                return
+            remaining = self.remainingEntries(folder)
+
+            # If folder is empty, unreadable or used up, drop it from its parent and start again
+            if not remaining:
+                self.stats.retry('empty')
+                if parentRemaining is None:
+                    self.allFilesSearched = True
+                    return
+                swapRemove(parentRemaining, parentIndex)
+                self.markProgress()
+                parentRemaining = None
+                folder = self.startAbsolute
+                continue
+
+            # Chooses random entry
+            index = self.random.randrange(len(remaining))
+            name = remaining[index]
+
+            # If random entry is folder
+            if name.endswith(os.sep):
+                parentRemaining, parentIndex = remaining, index
+                folder = os.path.join(folder, name[:-1])
+
+            # If random entry is file:
+            else:
+                swapRemove(remaining, index)
+                self.filesLeft -= 1
+                self.markProgress()
+                path = os.path.join(folder, name)
+                try:
+                    with self.stats.timer('stat'):
+                        size = os.stat(path).st_size
+                except OSError:
+                    self.stats.retry('missing')
+                    continue
+                # If file copy is valid (or queued for the copy workers)
+                if self.submitCandidate(path, size):
+                    return
+                # If file is invalid
+                parentRemaining = None
+                folder = self.startAbsolute
+
+    def remainingEntries(self, folder):
+        # Array of the entries of folder not used up this run. Listings are cached in listOfPaths across runs,
+        # unreadable folders are not cached and count as empty.
+        remaining = self.walkRemaining.get(folder)
+        if remaining is None:
+            listing = self.listOfPaths.get(folder)
+            if listing is None:
+                try:
+                    with self.stats.timer('listing'):
+                        listing = self.lister.list(folder) if self.lister else self.listFunction(folder)
+                    self.stats.count('foldersListed')
+                    self.listOfPaths[folder] = listing
+                except PermissionError:
+                    self.stats.retry('permission')
+                    listing = []
+                except OSError:
+                    self.stats.retry('unreadable')
+                    listing = []
+            elif self.lister:
+                # Listed ahead (or by an earlier run): list the folders below it ahead too
+                self.stats.count('listingsCached')
+                self.lister.prefetch(folder, listing, self.lister.depth)
+            # Only files matching the patterns and not picked yet are kept, so filesLeft counts eligible files
+            remaining = list(listing)
+            if self.patterns:
+                remaining = [name for name in remaining if name.endswith(os.sep) or matchesPatterns(name, self.patterns)]
+                self.stats.count('filtered', len(listing) - len(remaining))
+            if self.filterPicked:
+                remaining = [name for name in remaining if os.path.join(folder, name) not in self.pickedFiles]
+            subfolders = sum(1 for name in remaining if name.endswith(os.sep))
+            self.filesLeft += len(remaining) - subfolders
+            self.foldersUnlisted += subfolders - 1
+            self.walkRemaining[folder] = remaining
+            self.markProgress()
+        return remaining
+
+    def runReservoir(self):
+        # Streams the tree once and keeps the files still needed with the largest seeded keys (see seededKey), so the
+        # sample does not depend on the order folders are listed in. Files rejected by copyFilesToTarget are replaced
+        # by another pass over the files not yet picked, which takes the next largest keys.
+        # With scanWorkers the tree is scanned once on a process pool and every pass reads that scan.
+        withSizes = self.weighting == 'size'
+        rootLength = len(os.path.join(self.root, ''))
+        exhausted = False
+        scan = None
+        while self.needMoreFiles(drain=True):
+            if not self.pending:
+                # Fewer candidates than needed last pass means every eligible file has been picked
+                if exhausted:
+                    self.allFilesSearched = True
+                    return
+                needed = self.numberOfFiles - self.count
+                if self.scanWorkers > 1:
+                    if scan is None:
+                        with self.stats.timer('scan'):
+                            scan = scanTree(self.root, self.patterns, withSizes, self.scanWorkers)
+                        self.stats.count('foldersListed', scan.foldersListed)
+                        for cause, count in scan.retries.items():
+                            self.stats.retry(cause, count)
+                    files = scan.files(withSizes)
+                else:
+                    files = scanFiles(self.root, self.patterns, withSizes, self.stats)
+                candidates = (item for item in files if (item[0] if withSizes else item) not in self.pickedFiles)
+                with self.stats.timer('scan'):
+                    if withSizes:
+                        sample = keyedSample(candidates, needed, lambda item: seededKey(self.seed, item[0][rootLength:], item[1]))
+                    else:
+                        sample = keyedSample(candidates, needed, lambda path: seededKey(self.seed, path[rootLength:]))
+                        sample = [(path, None) for path in sample]
+                self.stats.count('scans')
+                # Largest key last, submitPending() pops from the end
+                self.pending = sample
+                exhausted = len(sample) < needed
+
+            if not self.submitPending():
+                return
+
+    def runIndexed(self):
+        # Samples from the persistent index of root, after listing again only the folders that changed
+        index = MandalaIndex(self.root, self.indexPath)
+        try:
+            if self.refreshIndex:
+                with self.stats.timer('indexRefresh'):
+                    self.stats.count('foldersListed', index.refresh(self.scanWorkers))
+            if self.weighting != 'uniform' or self.patterns:
+                return self.runWeighted(index)
+            # Ids of the files picked so far, including the picks of a resumed run
+            pickedIds = set()
+            for path in itertools.chain(self.pickedFiles, (path for path, size in self.pending)):
+                pickedIds.add(index.fileId(os.path.relpath(path, self.root)))
+            pickedIds.discard(None)
+            exhausted = False
+            while self.needMoreFiles(drain=True):
+                if not self.pending:
+                    if exhausted:
+                        self.allFilesSearched = True
+                        return
+                    needed = self.numberOfFiles - self.count
+                    with self.stats.timer('indexSample'):
+                        sample = index.sample(needed, self.random, pickedIds)
+                    pickedIds.update(fileId for fileId, relativePath, size in sample)
+                    self.pending = [(os.path.join(self.root, relativePath), None) for fileId, relativePath, size in sample]
+                    exhausted = len(sample) < needed
+
+                if not self.submitPending():
+                    return
+        finally:
+            index.close()
+
+    def runWeighted(self, index):
+        # One file per draw from the per-folder weights of the index (see WeightedSampler), without replacement
+        sampler = WeightedSampler(index, self.weighting, self.patterns)
+        while self.needMoreFiles():
+            if self.stopTracker:
+                return
+            self.checkpointIfDue()
+            with self.stats.timer('indexSample'):
+                row = sampler.draw(self.random)
+            if row is None:
+                self.allFilesSearched = True
+                return
+            fileId, relativePath, size = row
+            path = os.path.join(self.root, relativePath)
+            # Picked before a resume
+            if path in self.pickedFiles:
+                continue
+            self.submitCandidate(path)
+
+    def loadManifest(self):
+        # Without a count, all the files of the manifest are wanted
+        files = readManifest(self.manifestPath)['files']
+        self.pending = [(os.path.join(self.root, file['path']), None) for file in reversed(files)]
+        if self.numberOfFiles == sys.maxsize:
+            self.numberOfFiles = len(files)
+
+    def runManifest(self):
+        # Copies the files of a manifest in the order they were picked, relative to root, without any selection
+        while self.needMoreFiles():
+            if self.stopTracker:
+                return
+            if not self.pending:
+                self.allFilesSearched = True
+                return
+            self.checkpointIfDue()
+            path, size = self.pending.pop()
+            self.submitCandidate(path, size)
+
+    def submitPending(self):
+        # Submits the files picked but not submitted yet; False if the run was stopped
+        while self.pending:
+            if self.stopTracker:
+                return False
+            self.checkpointIfDue()
+            path, size = self.pending.pop()
+            self.submitCandidate(path, size)
+        return True
+
+    def needMoreFiles(self, drain=False):
+        # Without copy workers this is just hasRoom(). With them, files in flight count as picked:
+        # waits until they leave room for another pick, or with drain=True until they have all finished.
+        if self.copyPool is None:
+            return self.hasRoom()
+        if drain:
+            self.copyPool.waitUntilIdle()
+        return self.copyPool.waitForSlot()
+
+    def hasRoom(self, inFlight=0):
+        if self.count + inFlight >= self.numberOfFiles:
+            return False
+        return not self.byteBudget or self.bytesLeft() > 0
+
+    def bytesLeft(self):
+        if self.copyPool is None:
+            return self.byteBudget - self.bytesInCurrentFolder
+        # Read together with the bytes in flight: a finished copy moves from one to the other under this lock
+        with self.copyPool.condition:
+            return self.byteBudget - self.bytesInCurrentFolder - self.copyPool.inFlightBytes
+
+    def isTargetReached(self):
+        # A byte budget also counts as filled once every file has been tried and some did not fit any more
+        if self.count >= self.numberOfFiles:
+            return True
+        if not self.byteBudget:
+            return False
+        return self.bytesInCurrentFolder >= self.byteBudget or (self.budgetFull and self.allFilesSearched)
+
+    def submitCandidate(self, path, size=None):
+        # Copies one picked file now, or queues it for the copy workers and reports it as accepted.
+        # Returns False if the file has gone missing, does not fit the byte budget or was rejected.
+        self.pickedFiles.add(path)
+        if size is None:
+            try:
+                with self.stats.timer('stat'):
+                    size = os.path.getsize(path)
+            except OSError:
+                self.stats.retry('missing')
+                self.recordSkippedFile(path)
+                return False
+        if self.byteBudget and size > self.bytesLeft():
+            self.stats.retry('overBudget')
+            self.budgetFull = True
+            self.recordSkippedFile(path)
+            return False
+        if self.copyPool is None:
+            return self.copyCandidate(path, size)
+        self.copyPool.put(path, size)
+        return True
+
+    def copyCandidate(self, path, size):
+        if self.pickOnly:
+            self.recordCopiedFile(path, size, os.path.basename(path))
+            return True
+        targetName = self.copyFilesToTarget(self.count, Path(path), self.dest, size)
+        if targetName:
+            self.recordCopiedFile(path, size, targetName)
+            return True
+        self.recordSkippedFile(path)
+        return False
+
+    def recordCopiedFile(self, path, size, targetName):
+        relativePath = os.path.relpath(path, self.root)
+        with self.copyLock:
+            fileNumber = self.count + 1
+            self.journal.writeFile(fileNumber, relativePath, size, targetName)
+            self.copiedFiles.append((relativePath, size))
+            if self.copyPool is None:
+                self.addCopied(size)
+            else:
+                # Leaves the files in flight in the same step, so hasRoom() never counts it twice
+                self.copyPool.finishOne(path, size, lambda: self.addCopied(size))
+        self.logCallback(f'{fileNumber}: {relativePath}')
+        self.countCallback()
+
+    def addCopied(self, size):
+        self.bytesInCurrentFolder += size
+        self.count += 1
+        self.lastProgressTime = perf_counter()
+
+    def recordSkippedFile(self, path):
+        # Journaled so a resumed run does not pick it again; copies cut short by a stop may be picked again
+        if self.stopTracker:
+            return
+        with self.copyLock:
+            self.journal.writeSkip(os.path.relpath(path, self.root))
+
+    def copyFilesToTarget(self, fileNum, source, dest, sourceSize):
+        # Returns the name the file was copied to, or False if it was not copied
+        sourceAbsolute = os.path.abspath(source)
+        sourceName = None
+        if self.contentDedup:
+            with self.stats.timer('duplicateCheck'):
+                claimed = self.contentDedup.claim(sourceAbsolute, sourceSize)
+            if not claimed:
+                self.stats.retry('sameContent')
+                return False
+        try:
+            # Names are reserved under the lock so parallel copies of same-named files pick different targets
+            with self.copyLock:
+                sourceName = self.destIndex.reserve(source.name, sourceSize, checkDuplicates=not self.dedupContent)
+            if sourceName is None:
+                self.stats.retry('duplicate')
+                return False
+            startCopyTime = perf_counter()
+            if self.useFastCopy:
+                strategy = atomicCopy(sourceAbsolute, dest / f'{sourceName}', lambda: self.stopTracker)
+            else:
+                atomicCopy(sourceAbsolute, dest / f'{sourceName}', copy=lambda source, target, stopCheck: shutil.copy(source, target))
+                strategy = 'shutil'
+            copySeconds = perf_counter() - startCopyTime
+            self.stats.recordCopy(copySeconds, sourceSize)
+            with self.copyLock:
+                self.copyStrategies[strategy] += 1
+            return sourceName
+        except FileExistsError:
+            # Created by someone else since the destination was scanned, so the name stays taken
+            self.stats.retry('collision')
+            self.releaseContent(sourceAbsolute, sourceSize)
+            return False
+        except (PermissionError, CopyCancelled) as error:
+            self.stats.retry('permission' if isinstance(error, PermissionError) else 'cancelled')
+            if sourceName is not None:
+                with self.copyLock:
+                    self.destIndex.remove(sourceName, sourceSize)
+            self.releaseContent(sourceAbsolute, sourceSize)
+            return False
+
+    def releaseContent(self, path, size):
+        if self.contentDedup:
+            self.contentDedup.release(path, size)
+
+    def createFolders(self, target):
+        # Runs only append to the journal, the text log is built from it on demand (see MandalaJournal.py)
+        self.journal = RunJournal(journalPath(target), self.runSettings())
+        # Copies cut short by a crash are left as hidden temporary files, never under their real name
+        removePartials(target)
+        # One scan of the destination, kept up to date as files are copied
+        self.destIndex = DestinationIndex(target)
+        return target
+
+    ### CHECKPOINT METHODS ###
+
+    def resumeFromCheckpoint(self):
+        checkpoint = loadCheckpoint(self.checkpointPath)
+        if checkpoint is None:
+            return
+        settings = self.runSettings()
+        if any(checkpoint['settings'].get(key) != settings[key] for key in MATCHING_SETTINGS):
+            self.logCallback('Checkpoint was written with other settings, starting over')
+            return
+        try:
+            copied, skipped = picksFromJournal(journalPath(self.dest), checkpoint['run'])
+        except OSError:
+            self.logCallback('Run journal cannot be read, starting over')
+            return
+        self.resumed = checkpoint
+        self.seed = checkpoint['settings']['seed']
+        # Without a count of its own the resumed run wants what the stopped one did (a replay never reads its manifest again)
+        if self.numberOfFiles == sys.maxsize and checkpoint['settings'].get('count'):
+            self.numberOfFiles = checkpoint['settings']['count']
+        # The journal also has the files copied after the last checkpoint
+        self.count = max(checkpoint['count'], len(copied))
+        self.bytesInCurrentFolder = max(checkpoint['bytes'], sum(size for path, size in copied))
+        self.random.setstate(decodeRandomState(checkpoint['random']))
+        # Checkpoints from before picks were journaled list them all in 'picked'
+        for path in itertools.chain((path for path, size in copied), skipped, checkpoint.get('inFlight', []),
+                checkpoint.get('picked', [])):
+            self.pickedFiles.add(os.path.join(self.root, path))
+        self.pending = [(os.path.join(self.root, path), size) for path, size in checkpoint['pending']]
+        self.logCallback(f'Resuming from {self.count} files')
+
+    def checkpointIfDue(self):
+        # Called by the selection loops before each pick, so pickedFiles, pending and the random state agree
+        files, seconds = self.lastCheckpoint
+        if self.count - files >= CHECKPOINT_FILES or perf_counter() - seconds >= CHECKPOINT_SECONDS:
+            self.writeCheckpoint()
+
+    def writeCheckpoint(self):
+        with self.stats.timer('checkpoint'):
+            self.saveRunCheckpoint()
+
+    def saveRunCheckpoint(self):
+        # Copied and skipped files are in the journal. Files still being copied are kept here, so after a crash they
+        # are neither copied again nor counted.
+        rootLength = len(os.path.join(self.root, ''))
+        with self.copyLock:
+            count, copiedBytes = self.count, self.bytesInCurrentFolder
+            inFlight = self.copyPool.inFlightPaths() if self.copyPool else []
+            self.journal.flush()
+        saveCheckpoint(self.checkpointPath, {
+                'run': self.journal.runId,
+                'settings': self.runSettings(),
+                'count': count,
+                'bytes': copiedBytes,
+                'random': encodeRandomState(self.random.getstate()),
+                'inFlight': [path[rootLength:] for path in inFlight],
+                'pending': [[path[rootLength:], size] for path, size in self.pending]})
+        self.lastCheckpoint = (count, perf_counter())
+
+    ### PROGRESS, TIMER METHODS ###
+
+    def markProgress(self):
+        self.lastProgressTime = perf_counter()
+
+    def isStalled(self):
+        # Copies in flight are still progressing, however long a single one takes
+        if self.copyPool and self.copyPool.inFlight:
+            return False
+        self.stalled = perf_counter() - self.lastProgressTime > self.stallLimit
+        return self.stalled
+
+    def stopMandala(self):
+        end = self.journal.close(self.runResults())
+        if self.statsPath:
+            with open(self.statsPath, 'w', encoding='utf-8') as statsFile:
+                json.dump({'run': self.journal.runId, 'settings': self.journal.start, 'results': end}, statsFile, indent=1)
+        statusLog = formatStatus(self.journal.start, end)
+        self.logCallback(formatStatus(self.journal.start, end, wide=False))
+        return statusLog
+
+    ### LOG METHODS ###
+
+    def runSettings(self):
+        # Start record of the run journal
+        return {'root': str(self.root), 'dest': str(self.dest), 'count': None if self.numberOfFiles == sys.maxsize else self.numberOfFiles,
+                'byteBudget': self.byteBudget, 'mode': self.selectionMode, 'weighting': self.weighting,
+                'patterns': self.patterns, 'seed': self.seed, 'resumes': self.resumed['run'] if self.resumed else None}
+
+    def runResults(self):
+        # End record of the run journal
+        return {'status': self.writeStatusLog(), 'files': self.count, 'bytes': self.bytesInCurrentFolder,
+                'runtime': round(perf_counter() - self.startFolderTime, 2), 'copyMethods': dict(self.copyStrategies.most_common()),
+                'stats': self.stats.summary()}
+
+    def writeStatusLog(self):
+        status = ''
+        timeOut = self.stalled
+        copied = self.progressText()
+
+        if self.isTargetReached():
+            status = f'SUCCESS: {copied}'
+        elif timeOut and self.count == 0:
+            status = f'NO FILES FOUND: timed out'
+        elif self.allFilesSearched and self.count == 0:
+            status = f'NO FILES FOUND: all files searched'
+        elif self.allFilesSearched:
+            status = f'ALL FILES SEARCHED: {copied}'
+        elif timeOut:
+            status = f'TIMED OUT: {copied}'
+        elif self.stopTracker:
+            status = f'STOPPED: {copied}'
+        return status
+
+    def progressText(self):
+        if self.byteBudget and self.numberOfFiles == sys.maxsize:
+            return f'{self.count} files, {byteToMbGb(self.bytesInCurrentFolder)}/{byteToMbGb(self.byteBudget)} copied'
+        if self.byteBudget:
+            return f'{self.count}/{self.numberOfFiles} files, {byteToMbGb(self.bytesInCurrentFolder)}/{byteToMbGb(self.byteBudget)} copied'
+        return f'{self.count}/{self.numberOfFiles} files copied'
+
+
+class CopyPool:
+    # Bounded queue of picked files drained by copy worker threads.
+    # A queued file counts as in flight; if its copy is rejected the slot is freed and selection picks another.
+    def __init__(self, engine, workers, queueSize=None):
+        self.engine = engine
+        self.queue = queue.Queue(queueSize if queueSize else workers * 4)
+        self.inFlight = 0
+        self.inFlightBytes = 0
+        self.paths = set()
+        self.error = None
+        self.condition = threading.Condition()
+        self.threads = [threading.Thread(target=self.work, daemon=True) for worker in range(workers)]
+        for thread in self.threads:
+            thread.start()
+
+    def put(self, path, size):
+        with self.condition:
+            self.inFlight += 1
+            self.inFlightBytes += size
+            self.paths.add(path)
+        while not self.engine.stopTracker:
+            try:
+                self.queue.put((path, size), timeout=0.1)
+                return
+            except queue.Full:
+                continue
+        self.finishOne(path, size)
+
+    def work(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            try:
+                if not self.engine.stopTracker:
+                    self.engine.copyCandidate(*item)
+            except Exception as error:
+                # Stop the run and raise the error again from close(), like a failed copy without workers
+                self.error = error
+                self.engine.stopTracker = True
+            finally:
+                self.finishOne(*item)
+
+    def finishOne(self, path, size, onFinish=None):
+        # Once per file: after a copy, recordCopiedFile() finishes it together with counting it as copied
+        with self.condition:
+            if path not in self.paths:
+                return
+            if onFinish:
+                onFinish()
+            self.inFlight -= 1
+            self.inFlightBytes -= size
+            self.paths.discard(path)
+            self.condition.notify_all()
+
+    def inFlightPaths(self):
+        with self.condition:
+            return list(self.paths)
+
+    def waitForSlot(self):
+        # True when another file should be picked
+        engine = self.engine
+        with self.condition:
+            while not engine.stopTracker and self.inFlight > 0 and not engine.hasRoom(self.inFlight):
+                self.condition.wait(0.1)
+            return not engine.stopTracker and engine.hasRoom(self.inFlight)
+
+    def waitUntilIdle(self):
+        with self.condition:
+            while self.inFlight > 0:
+                self.condition.wait(0.1)
+
+    def close(self):
+        # Lets queued copies finish (they are skipped after a stop) and joins the workers
+        self.waitUntilIdle()
+        for thread in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+        if self.error:
+            raise self.error
+
+
+### SAMPLING ###
+
+def swapRemove(items, index):
+    # O(1) removal when the order of items does not matter
+    items[index] = items[-1]
+    items.pop()
+
+def scanFiles(root, patterns=None, withSizes=False, stats=None):
+    # Yields the path of every file under root matching patterns, or (path, size) with withSizes,
+    # with a single os.scandir pass. Unreadable folders are skipped (and counted in stats, if given).
+    stack = [os.fspath(root)]
+    while stack:
+        folder = stack.pop()
+        try:
+            if stats:
+                stats.count('foldersListed')
+            with os.scandir(folder) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                        elif entry.is_file() and matchesPatterns(entry.name, patterns):
+                            yield (entry.path, entry.stat().st_size) if withSizes else entry.path
+                    except OSError:
+                        continue
+        except PermissionError:
+            if stats:
+                stats.retry('permission')
+        except OSError:
+            if stats:
+                stats.retry('unreadable')
+
+def seededKey(seed, relativePath, size=None):
+    # Efraimidis-Spirakis key log(u) / weight, with u in (0, 1] hashed from the seed and the path instead of drawn from
+    # a random number generator. The files with the k largest keys are a sample of k without replacement, uniform
+    # without size or weighted by size (at least 1), and the same files for the same seed whatever order they come in.
+    digest = hashlib.blake2b(os.fsencode(relativePath), digest_size=8, key=str(seed).encode()).digest()
+    u = (int.from_bytes(digest, 'big') + 1) / 2**64
+    return math.log(u) / (max(size, 1) if size is not None else 1)
+
+def keyedSample(items, k, key):
+    # The k items with the largest key, in increasing key order, in O(n log k) time and O(k) memory
+    return heapq.nlargest(k, items, key=key)[::-1]
+
+
+### COMMAND LINE ###
+
+def parseArgs(argv):
+    parser = argparse.ArgumentParser(description='Copy random files from a root folder to a destination folder.')
+    parser.add_argument('count', type=int, help='number of files to copy (0 for no limit when --bytes is given)')
+    parser.add_argument('root', help='folder to copy from')
+    parser.add_argument('dest', help='folder to copy to')
+    parser.add_argument('--seed', type=int, default=None, help='seed for the random number generator')
+    parser.add_argument('--mode', choices=['walk', 'reservoir', 'index'], default='walk',
+            help='walk: random descent from root for each file, reservoir: single pass over the whole tree, '
+            'index: sample from the persistent index of root')
+    parser.add_argument('--index-path', default=None, help='index file for --mode index (default: one per root in the user cache folder)')
+    parser.add_argument('--workers', type=int, default=1, help='number of parallel copy workers')
+    parser.add_argument('--plain-copy', action='store_true', help='copy with shutil.copy instead of the fast copy backend')
+    parser.add_argument('--dedup-content', action='store_true',
+            help='skip files whose content is already in the destination, instead of comparing name and size')
+    parser.add_argument('--hash-cache', default=None, help='hash cache file for --dedup-content (default: in the user cache folder)')
+    parser.add_argument('--bytes', type=parseSize, default=None, help='stop once this much has been copied, e.g. 500M or 200G')
+    parser.add_argument('--weight', choices=['uniform', 'size'], default='uniform',
+            help='pick files uniformly or weighted by size (size needs --mode reservoir or index)')
+    parser.add_argument('--match', nargs='+', default=None, metavar='PATTERN',
+            help='only pick files matching these glob patterns or extensions, e.g. --match jpg png "IMG_*"')
+    parser.add_argument('--no-refresh', action='store_true', help='sample from the index as it is, without checking for changes')
+    parser.add_argument('--manifest', default=None, metavar='PATH', help='write the files this run copied to a manifest')
+    parser.add_argument('--replay', default=None, metavar='MANIFEST',
+            help='copy the files listed in a manifest instead of picking them (count 0 copies all of them)')
+    parser.add_argument('--prefetch', type=int, default=0, metavar='THREADS',
+            help='list folders ahead of the walk on this many threads, for network filesystems')
+    parser.add_argument('--scan-workers', type=int, default=0, metavar='PROCESSES',
+            help='scan the tree on this many processes for --mode reservoir and the first build of an index')
+    parser.add_argument('--list-latency', type=float, default=0, metavar='SECONDS',
+            help='add this much latency to every folder listing of the walk (for trying out --prefetch)')
+    parser.add_argument('--stats', default=None, metavar='PATH', help='write the statistics of the run as JSON')
+    parser.add_argument('--profile', default=None, metavar='PATH', help='profile the run with cProfile (read with python -m pstats PATH)')
+    parser.add_argument('--resume', action='store_true', help='carry on from the checkpoint an unfinished run left in the destination')
+    return parser.parse_args(argv)
+
+def parseSize(text):
+    units = {'': 1, 'K': 1024, 'M': 1024**2, 'G': 1024**3, 'T': 1024**4}
+    text = text.strip().upper().rstrip('B')
+    unit = text[-1:] if text[-1:] in units else ''
+    try:
+        return int(float(text[:len(text) - len(unit)]) * units[unit])
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'not a size: {text}')
+
+def main(argv=None):
+    args = parseArgs(argv)
+    if args.count < 0 or (args.count == 0 and not args.bytes and not args.replay):
+        sys.exit('count must be at least 1, or 0 with --bytes or --replay')
+    if args.weight == 'size' and args.mode == 'walk':
+        sys.exit('--weight size needs --mode reservoir or --mode index')
+    for folder in (args.root, args.dest):
+        if not os.path.isdir(folder):
+            sys.exit(f'not a folder: {folder}')
+
+    engine = MandalaEngine(args.count, args.root, args.dest, seed=args.seed,
+            selectionMode='manifest' if args.replay else args.mode, manifestPath=args.replay or args.manifest, logCallback=print, indexPath=args.index_path, refreshIndex=not args.no_refresh,
+            copyWorkers=args.workers, useFastCopy=not args.plain_copy,
+            dedupContent=args.dedup_content, hashCachePath=args.hash_cache, weighting=args.weight, patterns=args.match,
+            byteBudget=args.bytes, resume=args.resume, statsPath=args.stats, profilePath=args.profile,
+            prefetchWorkers=args.prefetch, listLatency=args.list_latency, scanWorkers=args.scan_workers)
+    try:
+        engine.runMandala()
+    except KeyboardInterrupt:
+        engine.stopTracker = True
+        engine.writeCheckpoint()
+        engine.stopMandala()
+        return 130
+    return 0 if engine.isTargetReached() else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,161 @@
+# Content-hash deduplication for Copy Random Files Lite.
+# Files are only compared when their sizes match. A partial hash of the first and last blocks is checked first,
+# and the full hash is only read when the partial hashes collide. Both are kept in a persistent cache keyed by
+# (path, size, mtime), so files that have not changed are never read again.
+
+import os
+import sqlite3
+import hashlib
+import threading
+import collections
+
+BLOCK_SIZE = 64 * 1024
+BUFFER_SIZE = 1024 * 1024
+COMMIT_EVERY = 1000
+
+
+def defaultCachePath():
+    cacheHome = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cacheHome, 'CopyRandomFilesLite', 'hashes.sqlite3')
+
+def partialHash(path, size):
+    digest = hashlib.blake2b(str(size).encode(), digest_size=16)
+    with open(path, 'rb') as file:
+        digest.update(file.read(BLOCK_SIZE))
+        if size > 2 * BLOCK_SIZE:
+            file.seek(-BLOCK_SIZE, os.SEEK_END)
+        digest.update(file.read(BLOCK_SIZE))
+    return digest.digest()
+
+def fullHash(path):
+    digest = hashlib.blake2b(digest_size=32)
+    buffer = bytearray(BUFFER_SIZE)
+    view = memoryview(buffer)
+    with open(path, 'rb') as file:
+        while True:
+            read = file.readinto(buffer)
+            if not read:
+                return digest.digest()
+            digest.update(view[:read])
+
+
+class HashCache:
+    def __init__(self, cachePath=None):
+        self.cachePath = cachePath if cachePath else defaultCachePath()
+        os.makedirs(os.path.dirname(os.path.abspath(self.cachePath)), exist_ok=True)
+        self.lock = threading.Lock()
+        self.pendingWrites = 0
+
+        # Shared by the copy workers, every access goes through self.lock
+        self.db = sqlite3.connect(self.cachePath, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS hashes '
+                '(path TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime INTEGER NOT NULL, partial BLOB, full BLOB)')
+
+    def hashes(self, path, withFull=False):
+        # Returns (partial, full) for path; full is None unless withFull is set or it was already cached
+        stat = os.stat(path)
+        with self.lock:
+            row = self.db.execute('SELECT size, mtime, partial, full FROM hashes WHERE path = ?', (path,)).fetchone()
+        if row and row[0] == stat.st_size and row[1] == stat.st_mtime_ns:
+            partial, full = row[2], row[3]
+        else:
+            partial, full = None, None
+
+        changed = False
+        if partial is None:
+            partial = partialHash(path, stat.st_size)
+            changed = True
+        if withFull and full is None:
+            full = fullHash(path)
+            changed = True
+
+        if changed:
+            with self.lock:
+                self.db.execute('INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?, ?)',
+                        (path, stat.st_size, stat.st_mtime_ns, partial, full))
+                self.pendingWrites += 1
+                if self.pendingWrites >= COMMIT_EVERY:
+                    self.db.commit()
+                    self.pendingWrites = 0
+        return partial, full
+
+    def close(self):
+        with self.lock:
+            self.db.commit()
+            self.db.close()
+
+
+class ContentDedup:
+    # Tracks the files already in the destination and the files claimed this run by size and partial hash, so a claim
+    # is one dict lookup and full hashes are only read for the files in the same (size, partial hash) bucket.
+    # Files are only hashed once a file of the same size is claimed, and each of them only once.
+    def __init__(self, cache):
+        self.cache = cache
+        self.lock = threading.Lock()
+        # Claims of the same size take turns, so of two identical files claimed at once the later one loses
+        self.sizeLocks = collections.defaultdict(threading.Lock)
+        self.unhashed = collections.defaultdict(list)  # size: paths not partially hashed yet
+        self.byPartial = collections.defaultdict(list)  # (size, partial hash): paths
+        self.keys = {}  # path: (size, partial hash)
+        self.fullHashes = {}
+
+    def addFiles(self, files):
+        # files: iterable of (absolutePath, size) already present in the destination
+        with self.lock:
+            for path, size in files:
+                self.unhashed[size].append(path)
+
+    def claim(self, path, size):
+        # Returns False if a file with the same content is already in the destination or claimed this run
+        with self.lock:
+            sizeLock = self.sizeLocks[size]
+        with sizeLock:
+            with self.lock:
+                peers = self.unhashed.pop(size, [])
+            for peer in peers:
+                try:
+                    self.add(peer, (size, self.cache.hashes(peer)[0]))
+                except OSError:
+                    continue
+            try:
+                key = (size, self.cache.hashes(path)[0])
+            except OSError:
+                return True
+            with self.lock:
+                bucket = list(self.byPartial.get(key, ()))
+            if bucket:
+                try:
+                    full = self.fullHash(path)
+                except OSError:
+                    return True
+                for peer in bucket:
+                    try:
+                        if self.fullHash(peer) == full:
+                            return False
+                    except OSError:
+                        continue
+            self.add(path, key)
+        return True
+
+    def add(self, path, key):
+        with self.lock:
+            self.byPartial[key].append(path)
+            self.keys[path] = key
+
+    def release(self, path, size):
+        # Forgets a claimed file whose copy did not happen
+        with self.lock:
+            key = self.keys.pop(path, None)
+            if key is not None:
+                self.byPartial[key].remove(path)
+            self.fullHashes.pop(path, None)
+
+    def fullHash(self, path):
+        full = self.fullHashes.get(path)
+        if full is None:
+            full = self.fullHashes[path] = self.cache.hashes(path, withFull=True)[1]
+        return full
+
+    def close(self):
+        self.cache.close()
@@ -0,0 +1,323 @@
+# Persistent index of a root folder for Copy Random Files Lite.
+# Every file under root is stored with its size and mtime in a SQLite database, so later runs can sample from it without walking the tree.
+# refresh() stats every known folder but only lists the ones whose mtime changed since the last refresh.
+# The first refresh of an empty index can scan the tree on several processes (see MandalaScan.py).
+# WeightedSampler draws files from an index uniformly or weighted by size, optionally only files matching glob patterns.
+# Sampling reads rows in id order, so with the same seed the same index gives the same files. Folders and files are
+# inserted depth first in name order, whether refreshed or built, so the ids do not depend on the order the file system
+# lists entries in or on how the index was filled.
+#   python MandalaIndex.py /path/to/root
+
+import os
+import sys
+import sqlite3
+import hashlib
+import fnmatch
+import argparse
+import itertools
+from time import perf_counter
+
+UNREADABLE = -1  # mtime stored for folders that could not be listed, so they are retried on every refresh
+GLOB_CHARACTERS = '*?['
+
+
+def defaultIndexPath(root):
+    cacheHome = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    rootHash = hashlib.sha1(os.path.abspath(root).encode('utf-8', 'surrogateescape')).hexdigest()
+    return os.path.join(cacheHome, 'CopyRandomFilesLite', f'{rootHash}.sqlite3')
+
+
+class MandalaIndex:
+    def __init__(self, root, indexPath=None):
+        self.root = os.path.abspath(root)
+        self.indexPath = indexPath if indexPath else defaultIndexPath(self.root)
+        os.makedirs(os.path.dirname(os.path.abspath(self.indexPath)), exist_ok=True)
+
+        self.db = sqlite3.connect(self.indexPath)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.createTables()
+
+    def createTables(self):
+        with self.db:
+            self.db.execute('CREATE TABLE IF NOT EXISTS info (key TEXT PRIMARY KEY, value TEXT)')
+            self.db.execute('CREATE TABLE IF NOT EXISTS folders '
+                    '(id INTEGER PRIMARY KEY, parent INTEGER, path TEXT UNIQUE NOT NULL, mtime INTEGER NOT NULL)')
+            self.db.execute('CREATE INDEX IF NOT EXISTS foldersParent ON folders (parent)')
+            self.db.execute('CREATE TABLE IF NOT EXISTS files '
+                    '(id INTEGER PRIMARY KEY, folder INTEGER NOT NULL, name TEXT NOT NULL, size INTEGER NOT NULL, mtime INTEGER NOT NULL)')
+            self.db.execute('CREATE INDEX IF NOT EXISTS filesFolder ON files (folder)')
+            self.db.execute('INSERT OR IGNORE INTO info VALUES (?, ?)', ('root', self.root))
+
+    def close(self):
+        self.db.close()
+
+    ### REFRESH METHODS ###
+
+    def refresh(self, workers=0):
+        # Returns the number of folders that had to be listed again
+        known = {path: (folderId, mtime) for folderId, path, mtime in self.db.execute('SELECT id, path, mtime FROM folders')}
+        if not known and workers > 1:
+            return self.build(workers)
+        seen = set()
+        rescanned = 0
+        stack = [('', None)]
+
+        with self.db:
+            while stack:
+                relative, parentId = stack.pop()
+                try:
+                    mtime = os.stat(os.path.join(self.root, relative)).st_mtime_ns
+                except OSError:
+                    continue
+
+                row = known.get(relative)
+                if row and row[1] == mtime:
+                    # Unchanged folder: its files are still valid, but its subfolders may have changed
+                    seen.add(row[0])
+                    subfolders = sorted(path for (path,) in self.db.execute('SELECT path FROM folders WHERE parent = ?', (row[0],)))
+                    stack.extend((path, row[0]) for path in reversed(subfolders))
+                    continue
+
+                folderId, subfolders = self.rescanFolder(relative, parentId, mtime, row[0] if row else None)
+                seen.add(folderId)
+                # Reversed, so the first subfolder is popped first
+                stack.extend((path, folderId) for path in reversed(subfolders))
+                rescanned += 1
+
+            # Folders that were not reached any more have been removed or moved
+            removed = [(folderId,) for folderId, mtime in known.values() if folderId not in seen]
+            self.db.executemany('DELETE FROM files WHERE folder = ?', removed)
+            self.db.executemany('DELETE FROM folders WHERE id = ?', removed)
+
+        self.compactFileIds()
+        return rescanned
+
+    def build(self, workers):
+        # Fills an empty index from a scan on worker processes, with the same rows a refresh would store
+        from MandalaScan import scanTree, UNLISTED  # MandalaScan imports this module
+        scan = scanTree(self.root, withStats=True, workers=workers)
+        offsets = list(itertools.accumulate(scan.fileCounts, initial=0))
+        # In the order refresh() visits folders: a folder before its subfolders, each level in name order
+        order = sorted(range(len(scan.folders)), key=lambda position: folderSortKey(scan.folders[position]))
+        folderIds = {}
+        with self.db:
+            for position in order:
+                parent, mtime = scan.parents[position], scan.folderTimes[position]
+                folderId = folderIds[position] = self.db.execute('INSERT INTO folders (parent, path, mtime) VALUES (?, ?, ?)',
+                        (folderIds[parent] if parent >= 0 else None, scan.folders[position], UNREADABLE if mtime == UNLISTED else mtime)).lastrowid
+                files = sorted(range(offsets[position], offsets[position + 1]), key=scan.names.__getitem__)
+                self.db.executemany('INSERT INTO files (folder, name, size, mtime) VALUES (?, ?, ?, ?)',
+                        ((folderId, scan.names[file], scan.sizes[file], scan.fileTimes[file]) for file in files))
+        return scan.foldersListed
+
+    def rescanFolder(self, relative, parentId, mtime, folderId):
+        files = []
+        subfolders = []
+        try:
+            with os.scandir(os.path.join(self.root, relative)) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            subfolders.append(os.path.join(relative, entry.name))
+                        elif entry.is_file():
+                            stat = entry.stat()
+                            files.append((entry.name, stat.st_size, stat.st_mtime_ns))
+                    except OSError:
+                        continue
+        except OSError:
+            mtime = UNREADABLE
+        files.sort()
+        subfolders.sort()
+
+        if folderId is None:
+            folderId = self.db.execute('INSERT INTO folders (parent, path, mtime) VALUES (?, ?, ?)',
+                    (parentId, relative, mtime)).lastrowid
+        else:
+            self.db.execute('UPDATE folders SET mtime = ? WHERE id = ?', (mtime, folderId))
+            self.db.execute('DELETE FROM files WHERE folder = ?', (folderId,))
+        self.db.executemany('INSERT INTO files (folder, name, size, mtime) VALUES (?, ?, ?, ?)',
+                ((folderId, name, size, fileMtime) for name, size, fileMtime in files))
+        return folderId, subfolders
+
+    def compactFileIds(self):
+        # sample() draws random ids, so keep the id range dense after many deletes
+        count, maxId = self.db.execute('SELECT COUNT(*), MAX(id) FROM files').fetchone()
+        if not maxId or count * 2 > maxId:
+            return
+        with self.db:
+            self.db.execute('CREATE TEMP TABLE packed AS SELECT folder, name, size, mtime FROM files ORDER BY id')
+            self.db.execute('DELETE FROM files')
+            self.db.execute('INSERT INTO files (folder, name, size, mtime) SELECT folder, name, size, mtime FROM packed')
+            self.db.execute('DROP TABLE packed')
+
+    ### SAMPLING METHODS ###
+
+    def fileCount(self):
+        return self.db.execute('SELECT COUNT(*) FROM files').fetchone()[0]
+
+    def fileRow(self, fileId):
+        row = self.db.execute('SELECT folders.path, files.name, files.size FROM files JOIN folders ON folders.id = files.folder '
+                'WHERE files.id = ?', (fileId,)).fetchone()
+        if row is None:
+            return None
+        return fileId, os.path.join(row[0], row[1]), row[2]
+
+    def fileId(self, relativePath):
+        # Id of the file at relativePath, or None if it is not in the index
+        folder, name = os.path.split(relativePath)
+        row = self.db.execute('SELECT files.id FROM files JOIN folders ON folders.id = files.folder '
+                'WHERE folders.path = ? AND files.name = ?', (folder, name)).fetchone()
+        return row[0] if row else None
+
+    def sample(self, k, rng, exclude=()):
+        # Returns up to k random (id, relativePath, size) rows whose id is not in exclude
+        remaining = self.fileCount() - len(exclude)
+        if remaining <= 0 or k <= 0:
+            return []
+
+        if k * 2 >= remaining:
+            # Most of the pool is wanted: one pass over the ids is cheaper than rejection sampling
+            ids = [fileId for (fileId,) in self.db.execute('SELECT id FROM files ORDER BY id') if fileId not in exclude]
+            picks = rng.sample(ids, min(k, len(ids)))
+        else:
+            maxId = self.db.execute('SELECT MAX(id) FROM files').fetchone()[0]
+            picks = []
+            picked = set()
+            while len(picks) < k:
+                fileId = rng.randint(1, maxId)
+                if fileId in picked or fileId in exclude:
+                    continue
+                if self.db.execute('SELECT 1 FROM files WHERE id = ?', (fileId,)).fetchone():
+                    picked.add(fileId)
+                    picks.append(fileId)
+        return [self.fileRow(fileId) for fileId in picks]
+
+
+def folderSortKey(relative):
+    # Sorting by this puts folders in depth first order with the subfolders of each folder in name order
+    return tuple(relative.split(os.sep)) if relative else ()
+
+def normalizePatterns(patterns):
+    # Lower-cased glob patterns; a bare extension such as 'jpg' or '.jpg' becomes '*.jpg'
+    normalized = []
+    for pattern in patterns or []:
+        pattern = pattern.strip().lower()
+        if not pattern:
+            continue
+        if not any(character in pattern for character in GLOB_CHARACTERS):
+            pattern = '*.' + pattern.lstrip('.')
+        normalized.append(pattern)
+    return normalized
+
+def matchesPatterns(name, patterns):
+    # patterns must already be normalized; an empty list matches everything
+    if not patterns:
+        return True
+    name = name.lower()
+    return any(fnmatch.fnmatchcase(name, pattern) for pattern in patterns)
+
+
+class FenwickTree:
+    # Integer weights with O(log n) updates and O(log n) lookup of the item that covers a given cumulative weight
+    def __init__(self, weights):
+        self.size = len(weights)
+        self.tree = [0] * (self.size + 1)
+        self.total = 0
+        for position, weight in enumerate(weights, 1):
+            self.tree[position] += weight
+            self.total += weight
+            parent = position + (position & -position)
+            if parent <= self.size:
+                self.tree[parent] += self.tree[position]
+
+    def add(self, index, delta):
+        self.total += delta
+        position = index + 1
+        while position <= self.size:
+            self.tree[position] += delta
+            position += position & -position
+
+    def find(self, target):
+        # Index of the item whose cumulative range contains target, for 0 <= target < total
+        position = 0
+        step = 1 << self.size.bit_length()
+        while step:
+            nextPosition = position + step
+            if nextPosition <= self.size and self.tree[nextPosition] <= target:
+                target -= self.tree[nextPosition]
+                position = nextPosition
+            step >>= 1
+        return position
+
+
+class WeightedSampler:
+    # Draws files from an index without replacement. Each file weighs 1 ('uniform') or its size ('size', at least 1),
+    # and only files matching the glob patterns are eligible. Per-folder totals are summed once in SQL and kept in a
+    # Fenwick tree. The files of a folder are read with one query the first time it is drawn and get a Fenwick tree of
+    # their own, so a draw costs O(log folders + log files in the folder).
+    def __init__(self, index, weighting='uniform', patterns=None):
+        self.index = index
+        self.weighting = weighting
+        self.filter, self.filterParams = self.patternFilter(normalizePatterns(patterns))
+
+        weight = 'COUNT(*)' if weighting == 'uniform' else 'SUM(MAX(size, 1))'
+        rows = index.db.execute(f'SELECT folder, {weight} FROM files WHERE {self.filter} GROUP BY folder ORDER BY folder',
+                self.filterParams).fetchall()
+        self.folders = [folderId for folderId, folderWeight in rows]
+        self.tree = FenwickTree([folderWeight for folderId, folderWeight in rows])
+        self.folderFiles = {}
+
+    def patternFilter(self, patterns):
+        if not patterns:
+            return '1', []
+        return '(' + ' OR '.join('lower(name) GLOB ?' for pattern in patterns) + ')', patterns
+
+    def loadFolder(self, position):
+        # (files, tree of their weights); drawn files keep their place with weight 0
+        folder = self.folderFiles.get(position)
+        if folder is None:
+            folderId = self.folders[position]
+            folderPath = self.index.db.execute('SELECT path FROM folders WHERE id = ?', (folderId,)).fetchone()[0]
+            files = [(fileId, os.path.join(folderPath, name), size) for fileId, name, size in self.index.db.execute(
+                    f'SELECT id, name, size FROM files WHERE folder = ? AND {self.filter} ORDER BY id',
+                    [folderId] + self.filterParams)]
+            weights = [1 if self.weighting == 'uniform' else max(size, 1) for fileId, path, size in files]
+            folder = self.folderFiles[position] = (files, FenwickTree(weights))
+        return folder
+
+    def draw(self, rng):
+        # Returns (id, relativePath, size) and removes it from the pool, or None once the pool is empty
+        if self.tree.total <= 0:
+            return None
+        position = self.tree.find(rng.randrange(self.tree.total))
+        files, fileTree = self.loadFolder(position)
+
+        fileIndex = fileTree.find(rng.randrange(fileTree.total))
+        fileId, path, size = files[fileIndex]
+        weight = 1 if self.weighting == 'uniform' else max(size, 1)
+        fileTree.add(fileIndex, -weight)
+        self.tree.add(position, -weight)
+        return fileId, path, size
+
+
+### COMMAND LINE ###
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Build or refresh the persistent index of a root folder.')
+    parser.add_argument('root', help='folder to index')
+    parser.add_argument('--index-path', default=None, help='index file (default: a file per root in the user cache folder)')
+    parser.add_argument('--workers', type=int, default=0, help='scan on this many processes when the index is built for the first time')
+    args = parser.parse_args(argv)
+    if not os.path.isdir(args.root):
+        sys.exit(f'not a folder: {args.root}')
+
+    startTime = perf_counter()
+    index = MandalaIndex(args.root, args.index_path)
+    rescanned = index.refresh(args.workers)
+    print(f'{index.indexPath}: {index.fileCount()} files, {rescanned} folders listed in {round(perf_counter() - startTime, 2)}s')
+    index.close()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
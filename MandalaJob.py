@@ -0,0 +1,326 @@
+# Runs over several roots and destinations for Copy Random Files Lite.
+# MandalaJob splits one job into MandalaEngine runs, one per root and destination:
+#   roots   'merged' samples all roots as one population: the number of files taken from each root is drawn uniformly
+#           over all their eligible files (in proportion to their total size with size weighting), and files a root
+#           cannot supply are taken from the others. 'quota' takes an equal share, or the counts in quotas, from each root.
+#   dests   'fanout' copies every picked file to every destination, 'shard' splits the picked files between them.
+# The files of every root are picked at the same time without copying them (pickOnly), and each destination then replays
+# a manifest of its share of them as soon as that root is done. Only the replays into the same destination folder take
+# turns (they share its journal, checkpoint and partial copies).
+#   python MandalaJob.py 100 --roots /mnt/a /mnt/b --dests /media/x /media/y --dests-mode shard
+
+import os
+import sys
+import bisect
+import random
+import argparse
+import itertools
+import tempfile
+import threading
+import collections
+import concurrent.futures
+from pathlib import Path
+from time import perf_counter
+from MandalaEngine import MandalaEngine, scanFiles
+from MandalaIndex import normalizePatterns
+from MandalaScan import scanTree
+from MandalaJournal import writeManifest
+
+ROOT_MODES = ('merged', 'quota')
+DEST_MODES = ('fanout', 'shard')
+
+
+class MandalaJob:
+    def __init__(self, numberOfFiles, roots, dests, rootMode='merged', destMode='fanout', quotas=None, seed=None,
+            logCallback=None, **engineOptions):
+        # engineOptions are passed on to every MandalaEngine (selectionMode, copyWorkers, patterns, weighting, ...)
+        if not numberOfFiles or numberOfFiles < 1:
+            raise ValueError('a job needs a number of files')
+        if rootMode not in ROOT_MODES:
+            raise ValueError(f'unknown root mode: {rootMode}')
+        if destMode not in DEST_MODES:
+            raise ValueError(f'unknown destination mode: {destMode}')
+        if quotas is not None and len(quotas) != len(roots):
+            raise ValueError('quotas needs one count per root')
+        self.numberOfFiles = numberOfFiles
+        self.roots = [Path(os.path.abspath(root)) for root in roots]
+        self.dests = [Path(os.path.abspath(dest)) for dest in dests]
+        self.rootMode = rootMode
+        self.destMode = destMode
+        self.quotas = quotas
+        self.seed = seed if seed is not None else random.SystemRandom().randrange(2**32)
+        self.random = random.Random(self.seed)
+        self.logCallback = logCallback if logCallback else lambda s: None
+        self.engineOptions = engineOptions
+        # With fan-out every file is copied once per destination
+        self.totalFiles = numberOfFiles * (len(self.dests) if destMode == 'fanout' else 1)
+
+        self.engines = []
+        self.engineLock = threading.Lock()
+        self.folderLocks = collections.defaultdict(threading.Lock)
+        self.executor = None
+        self.replays = []
+        self.scratchNumbers = itertools.count()  # names of the pick folders and manifests
+        self.stopped = False
+        self.startFolderTime = perf_counter()
+
+    ### PROGRESS ###
+
+    # Read by the window like the attributes of a single MandalaEngine
+    @property
+    def count(self):
+        return sum(engine.count for engine in list(self.engines) if not engine.pickOnly)
+
+    @property
+    def bytesInCurrentFolder(self):
+        return sum(engine.bytesInCurrentFolder for engine in list(self.engines) if not engine.pickOnly)
+
+    @property
+    def stopTracker(self):
+        return self.stopped
+
+    @stopTracker.setter
+    def stopTracker(self, value):
+        self.stopped = value
+        with self.engineLock:
+            for engine in self.engines:
+                engine.stopTracker = value
+
+    def isTargetReached(self):
+        return self.count >= self.totalFiles
+
+    ### RUN METHODS ###
+
+    def runMandala(self):
+        self.startFolderTime = perf_counter()
+        copied = [[] for root in self.roots]  # (relativePath, size) copied from each root
+        # Picks, replays and population counts all run on this pool; only replays wait, for their destination folder
+        with tempfile.TemporaryDirectory(prefix='mandala-job-') as self.manifestFolder, \
+                concurrent.futures.ThreadPoolExecutor(max_workers=len(self.roots) * (len(self.dests) + 1)) as self.executor:
+            quotas = self.rootQuotas()
+            self.runSelection(quotas, copied)
+            for future in list(self.replays):
+                future.result()
+
+        status = f'{self.count}/{self.totalFiles} files copied from {len(self.roots)} roots to {len(self.dests)} destinations'
+        self.logCallback(('SUCCESS: ' if self.isTargetReached() else 'INCOMPLETE: ') + status)
+        return status
+
+    def rootQuotas(self):
+        if self.quotas is not None:
+            return list(self.quotas)
+        if self.rootMode == 'quota':
+            share, extra = divmod(self.numberOfFiles, len(self.roots))
+            return [share + (1 if rootIndex < extra else 0) for rootIndex in range(len(self.roots))]
+        self.populations = self.countPopulations()
+        return self.allocate(self.numberOfFiles, [files for files, size in self.populations],
+                [size for files, size in self.populations])
+
+    def countPopulations(self):
+        # (number of files, total size) eligible in each root, counted in parallel
+        patterns = normalizePatterns(self.engineOptions.get('patterns'))
+        populations = [(0, 0)] * len(self.roots)
+
+        def countRoot(rootIndex):
+            if self.engineOptions.get('scanWorkers', 0) > 1:
+                scan = scanTree(self.roots[rootIndex], patterns, withStats=True, workers=self.engineOptions['scanWorkers'])
+                populations[rootIndex] = (scan.fileCount, sum(scan.sizes))
+                return
+            files, size = 0, 0
+            for path, fileSize in scanFiles(self.roots[rootIndex], patterns, withSizes=True):
+                files += 1
+                size += fileSize
+            populations[rootIndex] = (files, size)
+
+        self.runTasks([((), lambda rootIndex=rootIndex: countRoot(rootIndex)) for rootIndex in range(len(self.roots))])
+        return populations
+
+    def allocate(self, count, files, sizes):
+        # Files to take from each root, at most its number of files
+        total = sum(files)
+        if count >= total:
+            return list(files)
+        if self.engineOptions.get('weighting') == 'size':
+            # Draws with replacement in proportion to total size, so only approximately a weighted sample of files.
+            # Draws over the files a root has are drawn again from the roots that still have room; a full root drops
+            # out, so this takes at most one round per root.
+            quotas = [0] * len(files)
+            while count > 0:
+                weights = [max(size, 1) if quota < limit else 0 for quota, limit, size in zip(quotas, files, sizes)]
+                for rootIndex in self.random.choices(range(len(files)), weights=weights, k=count):
+                    quotas[rootIndex] += 1
+                count = sum(max(quota - limit, 0) for quota, limit in zip(quotas, files))
+                quotas = [min(quota, limit) for quota, limit in zip(quotas, files)]
+            return quotas
+        # Uniform over all files: pick count positions in the concatenated roots, without replacement
+        bounds = list(itertools.accumulate(files))
+        quotas = [0] * len(files)
+        for position in self.random.sample(range(total), count):
+            quotas[bisect.bisect_right(bounds, position)] += 1
+        return quotas
+
+    def runSelection(self, quotas, copied):
+        # Picks the files of every root at the same time. In merged mode, files a root could not supply are taken from
+        # the roots that still have some, in more rounds.
+        wanted = list(quotas)
+        picked = [[] for root in self.roots]  # (relativePath, size) picked from each root, copied or not
+        used = [False] * len(self.roots)
+        while any(wanted) and not self.stopped:
+            pickedBefore = [len(files) for files in picked]
+            copiedBefore = [len(files) for files in copied]
+            seeds = [self.random.randrange(2**32) for root in self.roots]
+
+            def selectRoot(rootIndex):
+                self.selectFromRoot(rootIndex, wanted[rootIndex], seeds[rootIndex], picked, copied)
+
+            self.runTasks([((), lambda rootIndex=rootIndex: selectRoot(rootIndex))
+                    for rootIndex in range(len(self.roots)) if wanted[rootIndex]])
+            if self.rootMode != 'merged' or self.quotas is not None:
+                return
+
+            # A root that gave fewer picks than asked for has run out of files or timed out, the others may have more.
+            # Picks a destination did not take (same name and size, same content, ...) are made up from any root.
+            for rootIndex in range(len(self.roots)):
+                used[rootIndex] = used[rootIndex] or len(picked[rootIndex]) - pickedBefore[rootIndex] < wanted[rootIndex]
+            shortfall = sum(wanted) - sum(len(files) - before for files, before in zip(copied, copiedBefore))
+            left = [0 if used[rootIndex] else max(files - len(picked[rootIndex]), 0) for rootIndex, (files, size) in enumerate(self.populations)]
+            if shortfall <= 0 or not any(left):
+                return
+            wanted = self.allocate(shortfall, left, [size for files, size in self.populations])
+
+    def selectFromRoot(self, rootIndex, count, seed, picked, copied):
+        # Picks count files of a root without waiting for any destination, then replays them into every destination
+        # (fan-out) or splits them between the destinations (shard). With fan-out later rounds only need what the
+        # first destination took; the replays into the others are waited for at the end.
+        files = self.pickFromRoot(rootIndex, count, seed, picked)
+        if self.destMode == 'fanout':
+            shards = [files] * len(self.dests)
+        else:
+            shards = []
+            share, extra = divmod(len(files), len(self.dests))
+            for destIndex in range(len(self.dests)):
+                # The shards that get one file more rotate with the root, so no destination gets all of them
+                start = sum(map(len, shards))
+                shards.append(files[start:start + share + (1 if (destIndex + rootIndex) % len(self.dests) < extra else 0)])
+
+        manifests = {}
+        for shard in shards:
+            if shard and id(shard) not in manifests:
+                manifests[id(shard)] = self.writePicks(rootIndex, shard)
+        replays = [(destIndex, self.startReplay(rootIndex, dest, manifests[id(shard)]))
+                for destIndex, (dest, shard) in enumerate(zip(self.dests, shards)) if shard]
+        for destIndex, future in replays:
+            if self.destMode == 'fanout' and destIndex > 0:
+                with self.engineLock:
+                    self.replays.append(future)
+                continue
+            engine = future.result()
+            if engine:
+                copied[rootIndex].extend(engine.copiedFiles)
+
+    def pickFromRoot(self, rootIndex, count, seed, picked):
+        # Journals the picks in a folder of their own, skipping the files picked from the same root before,
+        # so shards and rounds never pick a file twice
+        root = self.roots[rootIndex]
+        exclude = [os.path.join(root, path) for path, size in picked[rootIndex]]
+        pickFolder = Path(self.manifestFolder, f'picks-{next(self.scratchNumbers)}')
+        pickFolder.mkdir()
+        engine = self.startEngine(count, root, pickFolder,
+                dict(self.engineOptions, seed=seed, exclude=exclude, copyWorkers=1, pickOnly=True))
+        picked[rootIndex].extend(engine.copiedFiles)
+        return engine.copiedFiles
+
+    def writePicks(self, rootIndex, files):
+        manifestPath = os.path.join(self.manifestFolder, f'{rootIndex}-{next(self.scratchNumbers)}.json')
+        writeManifest(manifestPath, {'root': str(self.roots[rootIndex]), 'count': len(files),
+                'files': [{'path': path, 'size': size} for path, size in files]})
+        return manifestPath
+
+    def startReplay(self, rootIndex, dest, manifestPath):
+        # Copies the files of a manifest picked from a root to dest, holding only the lock of dest
+        root = self.roots[rootIndex]
+        return self.submitTask([dest], lambda:
+                self.startEngine(0, root, dest, dict(self.engineOptions, selectionMode='manifest', manifestPath=manifestPath)))
+
+    def startEngine(self, count, root, dest, options):
+        prefix = f'[{root.name or root} > {dest.name or dest}] '
+        engine = MandalaEngine(count, root, dest, logCallback=lambda s: self.logCallback(prefix + s), **options)
+        with self.engineLock:
+            engine.stopTracker = self.stopped
+            self.engines.append(engine)
+        engine.runMandala()
+        return engine
+
+    ### TASKS ###
+
+    def folderLocksFor(self, folders):
+        # Always taken in the same order, so runs that share folders cannot deadlock
+        with self.engineLock:
+            locks = [self.folderLocks[os.path.abspath(folder)] for folder in sorted(set(map(os.path.abspath, folders)))]
+        return FolderLocks(locks)
+
+    def submitTask(self, folders, function):
+        # Runs function on the pool while holding the locks of the destination folders it writes to.
+        # The future gives what function returned, or None if the job was stopped before it started.
+        def runTask():
+            with self.folderLocksFor(folders):
+                if not self.stopped:
+                    return function()
+        return self.executor.submit(runTask)
+
+    def runTasks(self, tasks):
+        # Runs (folders, function) tasks and waits for them
+        for future in [self.submitTask(folders, function) for folders, function in tasks]:
+            future.result()
+
+
+class FolderLocks:
+    def __init__(self, locks):
+        self.locks = locks
+
+    def __enter__(self):
+        for lock in self.locks:
+            lock.acquire()
+
+    def __exit__(self, *error):
+        for lock in reversed(self.locks):
+            lock.release()
+
+
+### COMMAND LINE ###
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Copy random files from several roots to several destinations.')
+    parser.add_argument('count', type=int, help='number of files to pick')
+    parser.add_argument('--roots', nargs='+', required=True, help='folders to copy from')
+    parser.add_argument('--dests', nargs='+', required=True, help='folders to copy to')
+    parser.add_argument('--roots-mode', choices=ROOT_MODES, default='merged',
+            help='merged: sample all roots as one population, quota: an equal share (or --quotas) from each root')
+    parser.add_argument('--quotas', nargs='+', type=int, default=None, help='files to take from each root')
+    parser.add_argument('--dests-mode', choices=DEST_MODES, default='fanout',
+            help='fanout: copy every file to every destination, shard: split the files between them')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--mode', choices=['walk', 'reservoir', 'index'], default='walk')
+    parser.add_argument('--workers', type=int, default=1, help='copy workers per run')
+    parser.add_argument('--weight', choices=['uniform', 'size'], default='uniform')
+    parser.add_argument('--match', nargs='+', default=None, metavar='PATTERN')
+    parser.add_argument('--scan-workers', type=int, default=0, metavar='PROCESSES', help='processes scanning each root')
+    args = parser.parse_args(argv)
+    if args.weight == 'size' and args.mode == 'walk':
+        sys.exit('--weight size needs --mode reservoir or --mode index')
+    for folder in args.roots + args.dests:
+        if not os.path.isdir(folder):
+            sys.exit(f'not a folder: {folder}')
+
+    job = MandalaJob(args.count, args.roots, args.dests, rootMode=args.roots_mode, destMode=args.dests_mode,
+            quotas=args.quotas, seed=args.seed, logCallback=print, selectionMode=args.mode, copyWorkers=args.workers,
+            weighting=args.weight, patterns=args.match, scanWorkers=args.scan_workers)
+    try:
+        job.runMandala()
+    except KeyboardInterrupt:
+        job.stopTracker = True
+        return 130
+    return 0 if job.isTargetReached() else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
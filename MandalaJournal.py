@@ -0,0 +1,184 @@
+# Append-only run journal for Copy Random Files Lite.
+# Each destination folder has a JSON Lines file, '!<folder>_log.jsonl', that runs only ever append to:
+#   {"type": "start", "run": ..., "time": ..., "root": ..., "dest": ..., ...}    once per run
+#   {"type": "file", "run": ..., "n": 1, "path": "a/b.jpg", "size": ..., "target": "b.jpg"}    per copied file
+#   {"type": "skip", "run": ..., "path": "a/c.jpg"}    per picked file that was not copied (duplicate, missing, ...)
+#   {"type": "end", "run": ..., "time": ..., "status": ..., "files": ..., "bytes": ..., ...}    once per run
+# The human-readable log is built from it on demand:
+#   python MandalaJournal.py /path/to/destination [--last 3]
+# and so is a manifest of the files a run copied, which MandalaEngine.py --replay copies again without picking:
+#   python MandalaJournal.py /path/to/destination --manifest picks.json
+
+import sys
+import json
+import uuid
+import argparse
+import datetime
+from pathlib import Path
+from MandalaStats import formatStats
+
+BUFFER_SIZE = 64 * 1024
+
+
+def journalPath(dest):
+    dest = Path(dest)
+    return dest / f'!{dest.name}_log.jsonl'
+
+def byteToMbGb(bytesInCurrentFolder):
+    BYTE_TO_MEGABYTE = 9.53674316406 * 10**(-7)
+    BYTE_TO_GIGABYTE = 9.31322575 * 10**(-10)
+    byteInGigabyte = 1073741824
+    if bytesInCurrentFolder < byteInGigabyte - 1:
+        return f'{round(bytesInCurrentFolder * BYTE_TO_MEGABYTE, 2)} MB'
+    else:
+        return f'{round(bytesInCurrentFolder * BYTE_TO_GIGABYTE, 2)} GB'
+
+
+class RunJournal:
+    def __init__(self, path, start):
+        # start holds the run settings; 'type', 'run' and 'time' are filled in here
+        self.path = path
+        self.runId = uuid.uuid4().hex
+        self.start = dict(type='start', run=self.runId, time=datetime.datetime.now().isoformat(), **start)
+        self.file = open(path, 'a', encoding='utf-8', buffering=BUFFER_SIZE)
+        self.write(self.start)
+
+    def write(self, record):
+        self.file.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+    def writeFile(self, number, relativePath, size, target):
+        # Flushed at once: the file is already in place, and a resumed run counts the copied files from these records
+        self.write({'type': 'file', 'run': self.runId, 'n': number, 'path': relativePath, 'size': size, 'target': target})
+        self.file.flush()
+
+    def writeSkip(self, relativePath):
+        self.write({'type': 'skip', 'run': self.runId, 'path': relativePath})
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self, end):
+        # end holds the run results; returns the complete end record
+        end = dict(type='end', run=self.runId, time=datetime.datetime.now().isoformat(), **end)
+        self.write(end)
+        self.file.close()
+        return end
+
+
+### READING ###
+
+def readRuns(path):
+    # Runs in the order they started, as {'start': record, 'files': [records], 'skipped': [records], 'end': record or None}.
+    # A line cut short by a crash is skipped.
+    runs = {}
+    with open(path, 'r', encoding='utf-8') as journal:
+        for line in journal:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            run = runs.setdefault(record.get('run'), {'start': None, 'files': [], 'skipped': [], 'end': None})
+            if record.get('type') == 'file':
+                run['files'].append(record)
+            elif record.get('type') == 'skip':
+                run['skipped'].append(record)
+            else:
+                run[record.get('type')] = record
+    return [run for run in runs.values() if run['start']]
+
+def formatStatus(start, end, wide=True):
+    # The status block of a run; wide lines up the columns in a text file, narrow in the window
+    tab = '\t\t' if wide else '\t'
+    if end is None:
+        end = {'status': 'INCOMPLETE: the run did not finish', 'time': start['time'], 'bytes': 0, 'runtime': 0, 'copyMethods': {}}
+    endTime = datetime.datetime.fromisoformat(end['time'])
+    copyMethods = ', '.join(f'{strategy} {count}' for strategy, count in end['copyMethods'].items()) or 'none'
+    # Runs journaled before statistics were kept have none
+    stats = ''.join(f'\n    {line}' for line in formatStats(end['stats'], tab)) if end.get('stats') else ''
+    return f'''------------------------------------------------------------------------
+    {end['status']}
+    ------------------------------------------------------------------------
+    Date:{tab}{endTime.strftime('%B %d, %Y')}
+    Time:{tab}{endTime.strftime('%I:%M:%S%p')}
+    Start:{tab}{start['root']}
+    Destination:\t{start['dest']}
+    Seed:{tab}{start.get('seed')}
+    Total size:\t{byteToMbGb(end['bytes'])}
+    Total runtime:\t{end['runtime']}s
+    Copy method:\t{copyMethods}{stats}
+    ------------------------------------------------------------------------'''
+
+def runChain(runs, runId):
+    # The run with runId and the runs it resumed, oldest first
+    chain = []
+    run = runs.get(runId)
+    while run:
+        chain.insert(0, run)
+        run = runs.get(run['start'].get('resumes'))
+    return chain
+
+def manifestFromJournal(path, runId=None):
+    # The files copied by a run (the last one by default) and the runs it resumed, oldest first, with its settings
+    runs = {run['start']['run']: run for run in readRuns(path)}
+    runId = runId if runId else next(reversed(runs), None)
+    if runId not in runs:
+        raise ValueError(f'no such run in {path}')
+    start = runs[runId]['start']
+    files = [{'path': record['path'], 'size': record['size']} for run in runChain(runs, runId) for record in run['files']]
+    return {'root': start['root'], 'mode': start['mode'], 'weighting': start['weighting'], 'patterns': start['patterns'],
+            'seed': start['seed'], 'count': len(files), 'files': files}
+
+def picksFromJournal(path, runId):
+    # (relativePath, size) of the files copied by a run and the runs it resumed, and relative paths of the picks they skipped
+    runs = {run['start']['run']: run for run in readRuns(path)}
+    copied, skipped = [], []
+    for run in runChain(runs, runId):
+        copied.extend((record['path'], record['size']) for record in run['files'])
+        skipped.extend(record['path'] for record in run['skipped'])
+    return copied, skipped
+
+def writeManifest(path, manifest):
+    with open(path, 'w', encoding='utf-8') as file:
+        json.dump(manifest, file, ensure_ascii=False, indent=1)
+
+def readManifest(path):
+    with open(path, 'r', encoding='utf-8') as file:
+        return json.load(file)
+
+def formatRun(run):
+    lines = [formatStatus(run['start'], run['end'])]
+    lines.extend(f"{record['n']}: {record['path']}" for record in run['files'])
+    return '\n'.join(lines)
+
+
+### COMMAND LINE ###
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Print the log of the runs that copied into a destination folder.')
+    parser.add_argument('dest', help='destination folder, or the .jsonl journal itself')
+    parser.add_argument('--last', type=int, default=None, help='only print the last N runs')
+    parser.add_argument('--manifest', default=None, metavar='PATH', help='write the files the last run copied to a manifest instead')
+    args = parser.parse_args(argv)
+
+    path = Path(args.dest)
+    if path.is_dir():
+        path = journalPath(path)
+    if not path.exists():
+        sys.exit(f'no journal: {path}')
+
+    if args.manifest:
+        manifest = manifestFromJournal(path)
+        writeManifest(args.manifest, manifest)
+        print(f"{args.manifest}: {manifest['count']} files")
+        return 0
+
+    runs = readRuns(path)
+    if args.last:
+        runs = runs[-args.last:]
+    # Newest first, like the old text log
+    for run in reversed(runs):
+        print(formatRun(run))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
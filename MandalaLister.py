@@ -0,0 +1,103 @@
+# Folder listing for the random walk of Copy Random Files Lite.
+# listFolder() lists one folder. PrefetchingLister lists the subfolders of every folder the walk reads on a thread pool,
+# a few levels ahead, so on network filesystems (SMB, NFS) the walk rarely waits for a round trip of its own.
+# delayedListing() adds a fixed latency to every listing, to try this out on a local disk:
+#   python MandalaEngine.py 100 /path/to/root /path/to/destination --prefetch 16 --list-latency 0.02
+
+import os
+import threading
+import concurrent.futures
+from time import sleep
+
+
+def listFolder(folder):
+    # Names of the files and subfolders of folder, subfolders with a trailing separator,
+    # using the entry types cached by os.scandir. Links to folders are not followed.
+    names = []
+    with os.scandir(folder) as entries:
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    names.append(entry.name + os.sep)
+                elif entry.is_file():
+                    names.append(entry.name)
+            except OSError:
+                continue
+    # Sorted, so a seeded walk does not depend on the order the filesystem lists entries in
+    names.sort()
+    return names
+
+def delayedListing(latency, listFunction=listFolder):
+    # listFunction with latency seconds added to every call, like a round trip to a file server
+    def listDelayed(folder):
+        sleep(latency)
+        return listFunction(folder)
+    return listDelayed
+
+
+class PrefetchingLister:
+    # Listings are stored in cache (the listOfPaths of the engine) as they complete. A folder the walk asks for while
+    # it is still being listed is waited for; one that is not known yet is listed on the calling thread.
+    # At most maxPending listings are queued or running, further subfolders are left to be listed on demand.
+    def __init__(self, cache, workers=8, depth=2, maxPending=None, listFunction=listFolder, stats=None):
+        self.cache = cache
+        self.depth = depth
+        self.maxPending = maxPending if maxPending else workers * 32
+        self.listFunction = listFunction
+        self.stats = stats
+        self.lock = threading.Lock()
+        self.futures = {}
+        self.closed = False
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix='prefetch')
+
+    def list(self, folder):
+        with self.lock:
+            future = self.futures.get(folder)
+        if future is None:
+            self.count('prefetchMisses')
+            listing = self.listFunction(folder)
+        else:
+            self.count('prefetchHits' if future.done() else 'prefetchWaits')
+            try:
+                listing = future.result()
+            except OSError:
+                # Failed in the background: list again here, so the caller sees the error
+                listing = self.listFunction(folder)
+        self.prefetch(folder, listing, self.depth)
+        return listing
+
+    def prefetch(self, folder, listing, depth):
+        if depth <= 0:
+            return
+        for name in listing:
+            if not name.endswith(os.sep):
+                continue
+            child = os.path.join(folder, name[:-1])
+            with self.lock:
+                if self.closed or len(self.futures) >= self.maxPending:
+                    return
+                if child in self.futures or child in self.cache:
+                    continue
+                future = self.executor.submit(self.listFunction, child)
+                self.futures[child] = future
+            future.add_done_callback(lambda future, child=child: self.finished(child, future, depth - 1))
+
+    def finished(self, folder, future, depth):
+        # Runs on a prefetch thread. Failed listings are forgotten, the walk lists them again on demand.
+        # The listing is cached before the future is dropped, so list() always finds one or the other.
+        failed = future.cancelled() or future.exception() is not None
+        if not failed:
+            self.cache[folder] = future.result()
+        with self.lock:
+            self.futures.pop(folder, None)
+        if not failed:
+            self.prefetch(folder, self.cache[folder], depth)
+
+    def count(self, name):
+        if self.stats:
+            self.stats.count(name)
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+        self.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,187 @@
+# Parallel scan of a root folder for Copy Random Files Lite.
+# scanTree() lists the top of the tree itself until there are enough subtrees to keep every worker busy (the top-level
+# subfolders, or the level below when there are only a few of them) and scans the subtrees on a process pool.
+# Each worker sends back compact arrays instead of one string per path: the folders it found with their parents and
+# number of files, the file names of all of them joined into one string, and file sizes and mtimes in typed arrays.
+# The arrays are merged into one TreeScan, which the single pass and the first build of the persistent index read from.
+# Unreadable folders are skipped like in scanFiles(): a PermissionError counts as 'permission', other errors as 'unreadable'.
+#   python MandalaScan.py /path/to/root --workers 8
+
+import os
+import sys
+import array
+import argparse
+import collections
+import multiprocessing
+import concurrent.futures
+from time import perf_counter
+from MandalaIndex import normalizePatterns, matchesPatterns
+
+UNLISTED = -1  # mtime of folders that could not be listed
+SEPARATOR = '\0'  # cannot occur in a file name
+TASKS_PER_WORKER = 4  # subtrees per worker, so one large subtree does not leave the other workers idle for long
+SPLIT_DEPTH = 3  # levels below root that may be listed here to find enough subtrees
+
+
+class TreeScan:
+    # Folders are relative to root ('' for root itself), in the order they were listed, so a parent always comes before
+    # its subfolders (parents holds its position, -1 for root). The files of a folder follow the files of the folders
+    # before it in names, sizes and fileTimes; sizes and times are only filled in with withStats.
+    def __init__(self, root):
+        self.root = os.fspath(root)
+        self.folders = []
+        self.parents = array.array('q')
+        self.folderTimes = array.array('q')
+        self.fileCounts = array.array('q')
+        self.names = []
+        self.sizes = array.array('q')
+        self.fileTimes = array.array('q')
+        self.foldersListed = 0
+        self.retries = collections.Counter()
+
+    def __getstate__(self):
+        # Sent from the workers as a few strings and arrays instead of millions of small strings
+        state = self.__dict__.copy()
+        state['folders'] = (len(self.folders), SEPARATOR.join(self.folders))
+        state['names'] = (len(self.names), SEPARATOR.join(self.names))
+        return state
+
+    def __setstate__(self, state):
+        for key in ('folders', 'names'):
+            count, joined = state[key]
+            state[key] = joined.split(SEPARATOR) if count else []
+        self.__dict__.update(state)
+
+    @property
+    def fileCount(self):
+        return len(self.names)
+
+    def merge(self, scan, parent):
+        # Appends a subtree scanned by a worker; its top folder is a subfolder of the folder at position parent
+        offset = len(self.folders)
+        self.folders.extend(scan.folders)
+        self.parents.extend(parent if folderParent < 0 else folderParent + offset for folderParent in scan.parents)
+        self.folderTimes.extend(scan.folderTimes)
+        self.fileCounts.extend(scan.fileCounts)
+        self.names.extend(scan.names)
+        self.sizes.extend(scan.sizes)
+        self.fileTimes.extend(scan.fileTimes)
+        self.foldersListed += scan.foldersListed
+        self.retries.update(scan.retries)
+
+    def files(self, withSizes=False):
+        # Like scanFiles(): the path of every file, or (path, size) with withSizes
+        offset = 0
+        for folder, fileCount in zip(self.folders, self.fileCounts):
+            folderPath = os.path.join(self.root, folder)
+            for fileIndex in range(offset, offset + fileCount):
+                path = os.path.join(folderPath, self.names[fileIndex])
+                yield (path, self.sizes[fileIndex]) if withSizes else path
+            offset += fileCount
+
+
+def scanFolder(scan, relative, parent, patterns, withStats):
+    # Lists one folder into scan. Returns its position and its subfolders, or (None, []) if it is gone.
+    folder = os.path.join(scan.root, relative)
+    mtime = 0
+    if withStats:
+        try:
+            mtime = os.stat(folder).st_mtime_ns
+        except OSError:
+            return None, []
+
+    subfolders = []
+    files = 0
+    scan.foldersListed += 1
+    try:
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        subfolders.append(os.path.join(relative, entry.name))
+                    elif entry.is_file() and matchesPatterns(entry.name, patterns):
+                        if withStats:
+                            stat = entry.stat()
+                            scan.sizes.append(stat.st_size)
+                            scan.fileTimes.append(stat.st_mtime_ns)
+                        scan.names.append(entry.name)
+                        files += 1
+                except OSError:
+                    continue
+    except PermissionError:
+        scan.retries['permission'] += 1
+        mtime = UNLISTED
+    except OSError:
+        scan.retries['unreadable'] += 1
+        mtime = UNLISTED
+
+    scan.folders.append(relative)
+    scan.parents.append(parent)
+    scan.folderTimes.append(mtime)
+    scan.fileCounts.append(files)
+    return len(scan.folders) - 1, subfolders
+
+def scanSubtrees(scan, tasks, patterns, withStats):
+    # Depth first from (relative folder, parent position) tasks, like scanFiles()
+    stack = list(tasks)
+    while stack:
+        relative, parent = stack.pop()
+        position, subfolders = scanFolder(scan, relative, parent, patterns, withStats)
+        stack.extend((subfolder, position) for subfolder in subfolders)
+
+def scanSubtree(root, relative, patterns, withStats):
+    # Runs in a worker process
+    scan = TreeScan(root)
+    scanSubtrees(scan, [(relative, -1)], patterns, withStats)
+    return scan
+
+def scanTree(root, patterns=None, withStats=False, workers=None):
+    # Returns a TreeScan of every file under root matching patterns (already normalized) on workers processes
+    # (default: one per CPU). With withStats the sizes and mtimes of files and mtimes of folders are read too.
+    workers = workers if workers else os.cpu_count() or 1
+    scan = TreeScan(root)
+    tasks = [('', -1)]
+    for depth in range(SPLIT_DEPTH):
+        if workers <= 1 or len(tasks) >= workers * TASKS_PER_WORKER:
+            break
+        nextTasks = []
+        for relative, parent in tasks:
+            position, subfolders = scanFolder(scan, relative, parent, patterns, withStats)
+            nextTasks.extend((subfolder, position) for subfolder in subfolders)
+        tasks = nextTasks
+
+    if workers <= 1 or len(tasks) <= 1:
+        scanSubtrees(scan, tasks, patterns, withStats)
+        return scan
+
+    # Spawned rather than forked: the engine scans while copy and prefetch threads may be running
+    context = multiprocessing.get_context('spawn')
+    with concurrent.futures.ProcessPoolExecutor(min(workers, len(tasks)), mp_context=context) as executor:
+        futures = [(parent, executor.submit(scanSubtree, scan.root, relative, patterns, withStats)) for relative, parent in tasks]
+        for parent, future in futures:
+            scan.merge(future.result(), parent)
+    return scan
+
+
+### COMMAND LINE ###
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Scan a root folder on several processes and count its files.')
+    parser.add_argument('root', help='folder to scan')
+    parser.add_argument('--workers', type=int, default=None, help='worker processes (default: one per CPU)')
+    parser.add_argument('--match', nargs='+', default=None, metavar='PATTERN', help='only count files matching these patterns')
+    parser.add_argument('--sizes', action='store_true', help='read file sizes and mtimes too')
+    args = parser.parse_args(argv)
+    if not os.path.isdir(args.root):
+        sys.exit(f'not a folder: {args.root}')
+
+    startTime = perf_counter()
+    scan = scanTree(args.root, normalizePatterns(args.match), args.sizes, args.workers)
+    retries = ', '.join(f'{cause} {count}' for cause, count in scan.retries.items()) or 'none'
+    size = f', {sum(scan.sizes)} bytes' if args.sizes else ''
+    print(f'{scan.fileCount} files{size} in {len(scan.folders)} folders ({retries} skipped) '
+          f'in {round(perf_counter() - startTime, 2)}s')
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,92 @@
+# Run statistics for Copy Random Files Lite.
+# RunStats counts events (folders listed, retries by cause) and times phases (listing, stat calls, duplicate checks,
+# copying, ...) for one run, and keeps a histogram of the copy latency of each file. It is shared by the selection
+# thread and the copy workers. summary() is stored in the end record of the run journal and formatStats() adds it to
+# the status block.
+
+import math
+import threading
+import contextlib
+import collections
+from time import perf_counter
+
+PERCENTILES = (50, 90, 99)
+
+
+class RunStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = collections.Counter()
+        self.retries = collections.Counter()
+        self.seconds = collections.Counter()
+        # Copy latency in powers of two microseconds: bucket b holds the copies that took up to 2**b microseconds
+        self.latency = collections.Counter()
+        self.slowestCopy = 0.0
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self.counts[name] += amount
+
+    def retry(self, cause, amount=1):
+        # A pick that did not end in a copied file: 'duplicate', 'sameContent', 'collision', 'permission', ...
+        with self.lock:
+            self.retries[cause] += amount
+
+    @contextlib.contextmanager
+    def timer(self, phase):
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = perf_counter() - start
+            with self.lock:
+                self.seconds[phase] += elapsed
+
+    def recordCopy(self, seconds, size):
+        bucket = max(0, math.ceil(math.log2(max(seconds * 1e6, 1))))
+        with self.lock:
+            self.latency[bucket] += 1
+            self.seconds['copy'] += seconds
+            self.counts['bytesCopied'] += size
+            self.slowestCopy = max(self.slowestCopy, seconds)
+
+    def percentile(self, percent):
+        # Upper bound of the bucket holding the given percentile (at most the slowest copy), in seconds
+        total = sum(self.latency.values())
+        if not total:
+            return None
+        seen = 0
+        for bucket in sorted(self.latency):
+            seen += self.latency[bucket]
+            if seen * 100 >= total * percent:
+                return min(2**bucket / 1e6, self.slowestCopy)
+
+    def summary(self):
+        with self.lock:
+            return {
+                'counts': dict(self.counts),
+                'retries': dict(self.retries.most_common()),
+                'seconds': {phase: round(seconds, 4) for phase, seconds in self.seconds.most_common()},
+                'copyLatency': {
+                    'histogram': [[2**bucket / 1e6, self.latency[bucket]] for bucket in sorted(self.latency)],
+                    'percentiles': {str(percent): self.percentile(percent) for percent in PERCENTILES},
+                    'max': round(self.slowestCopy, 6)}}
+
+
+def formatSeconds(seconds):
+    if seconds is None:
+        return '-'
+    if seconds < 1:
+        return f'{round(seconds * 1000, 2)}ms'
+    return f'{round(seconds, 2)}s'
+
+def formatStats(stats, tab='\t\t'):
+    # Lines for the status block, from summary()
+    retries = ', '.join(f'{cause} {count}' for cause, count in stats['retries'].items()) or 'none'
+    phases = ', '.join(f'{phase} {formatSeconds(seconds)}' for phase, seconds in stats['seconds'].items()) or 'none'
+    latency = stats['copyLatency']
+    percentiles = ', '.join(f'p{percent} {formatSeconds(seconds)}' for percent, seconds in latency['percentiles'].items())
+    return [f"Folders listed:\t{stats['counts'].get('foldersListed', 0)}",
+            f'Retries:{tab}{retries}',
+            f'Phases:{tab}{phases}',
+            f"Copy latency:\t{percentiles}, max {formatSeconds(latency['max'])}"]